@@ -25,8 +25,46 @@ class Settings:
     TEMPLATE_OVERSEA: Path = TEMP_DIR / "2_OVERSEA Machine list.xlsx"
     NON_CDS_SUPPLIER_FILE: Path = TEMP_DIR / "Non-CDs Supplier.csv"
 
-    # Concurrency settings
-    MAX_WORKERS: int = 4
+    # Concurrency settings. MAX_WORKERS=None sizes the scan pool from CPU
+    # count and available memory (see scheduler.py); set an int to cap it.
+    MAX_WORKERS: int | None = None
+    WORKER_MEMORY_MB: int = 300
+    SCAN_SECONDS_PER_PAGE: float = 0.2  # used to predict batch makespan
+
+    # PDFs with at least LARGE_PDF_PAGES pages are split into page ranges of
+    # PAGE_CHUNK_SIZE pages scanned by several workers of the scan pool
+    LARGE_PDF_PAGES: int = 40
+    PAGE_CHUNK_SIZE: int = 20
+
+    # Short entity names shown in the GUI, keyed by the Buyer value in the log
+    ENTITY_SHORT_NAMES: dict[str, str] = {
+        "GREEN PLANET DISTRIBUTION CENTRE COMPANY LIMITED": "GREEN PLANET",
+        "TECHTRONIC TOOLS (VIETNAM) COMPANY LIMITED": "TTI TOOLS",
+        "TECHTRONIC PRODUCTS (VIETNAM) COMPANY LIMITED": "TTI PRODUCTS",
+        "TECHTRONIC INDUSTRIES VIETNAM MANUFACTURING COMPANY LIMITED": "TTIVN MFG",
+        "TECHTRONIC INDUSTRIES VIETNAM MANUFACTURING COMPANY LIMITED – BRANCH IN DAU GIAY INDUSTRIAL PARK": "TTIVN MFG - CNDG"
+    }
+
+    # Retry settings for quarantined PDFs (see retry_queue.py)
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 5.0  # seconds, doubled after each failed attempt
+
+    # Batched request emails (one email per supplier and entity): the PDFs and
+    # templates attached to one email stay under this size, larger groups are
+    # split over several emails
+    EMAIL_MAX_ATTACHMENT_MB: float = 20.0
+
+    # Distributed scanning through a shared queue directory (see work_queue.py):
+    # a lease expires after QUEUE_LEASE_SECONDS without renewal, and a job
+    # whose lease expired QUEUE_MAX_ATTEMPTS times is moved to failed/
+    QUEUE_LEASE_SECONDS: float = 300.0
+    QUEUE_MAX_ATTEMPTS: int = 3
+    QUEUE_BATCH_SIZE: int = 8
+
+    # Log rows older than this many days with no pending request email are
+    # moved from po_log.csv to the Parquet archive (see po_archive.py); 0 or
+    # None keeps everything in po_log.csv
+    ARCHIVE_AFTER_DAYS: int | None = 90
 
     def __init__(self, **overrides):
         """
@@ -52,3 +90,15 @@ TEMPLATE_LOCAL = settings.TEMPLATE_LOCAL
 TEMPLATE_OVERSEA = settings.TEMPLATE_OVERSEA
 NON_CDS_SUPPLIER_FILE = settings.NON_CDS_SUPPLIER_FILE
 MAX_WORKERS = settings.MAX_WORKERS
+WORKER_MEMORY_MB = settings.WORKER_MEMORY_MB
+SCAN_SECONDS_PER_PAGE = settings.SCAN_SECONDS_PER_PAGE
+LARGE_PDF_PAGES = settings.LARGE_PDF_PAGES
+PAGE_CHUNK_SIZE = settings.PAGE_CHUNK_SIZE
+ENTITY_SHORT_NAMES = settings.ENTITY_SHORT_NAMES
+RETRY_MAX_ATTEMPTS = settings.RETRY_MAX_ATTEMPTS
+RETRY_BASE_DELAY = settings.RETRY_BASE_DELAY
+EMAIL_MAX_ATTACHMENT_MB = settings.EMAIL_MAX_ATTACHMENT_MB
+QUEUE_LEASE_SECONDS = settings.QUEUE_LEASE_SECONDS
+QUEUE_MAX_ATTEMPTS = settings.QUEUE_MAX_ATTEMPTS
+QUEUE_BATCH_SIZE = settings.QUEUE_BATCH_SIZE
+ARCHIVE_AFTER_DAYS = settings.ARCHIVE_AFTER_DAYS
@@ -0,0 +1,292 @@
+"""In-memory fake of the Outlook COM object model for load-testing the fetch path.
+
+``read_po_emails_and_save_pdfs`` and ``resolve_email`` can only be measured
+against a live Outlook profile. This module provides the subset of the object
+model they use (Namespace, Folders, Items with ``Sort``/``Restrict``,
+MailItem, Attachments, Recipients, AddressEntry, ExchangeUser,
+PropertyAccessor) with a configurable latency per COM call, plus a generator
+for mailboxes of 10k–100k messages. Every public property read, property
+write, method call and enumerator step counts as one COM round-trip, so
+``CallCounter`` reports the number of calls per message.
+
+Example:
+>>> counter = CallCounter(latency=0.0002)
+>>> outlook = generate_mailbox(10_000, counter=counter)
+>>> read_po_emails_and_save_pdfs(tmp_dir, FAKE_ACCOUNT, FAKE_FOLDER_PATH, outlook=outlook)
+>>> counter.total, counter.by_name.most_common(5)
+"""
+from __future__ import annotations
+
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+FAKE_ACCOUNT = "loadtest@ttigroup.com.vn"
+FAKE_FOLDER_PATH = ["CUS", "CUS MACHINE", "ERP PO"]
+
+PR_SMTP_ADDRESS = "http://schemas.microsoft.com/mapi/proptag/0x39FE001E"
+
+# Small but valid one-page PDF; a per-message comment keeps contents unique
+_PDF_TEMPLATE = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+class CallCounter:
+    """Counts simulated COM round-trips and sleeps ``latency`` seconds for each."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.by_name: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, name: str) -> None:
+        with self._lock:
+            self.by_name[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def total(self) -> int:
+        return sum(self.by_name.values())
+
+    def reset(self) -> None:
+        with self._lock:
+            self.by_name.clear()
+
+
+class _ComObject:
+    """Base class: public attribute access and assignment count as COM calls."""
+
+    def __init__(self, counter: CallCounter, **attrs):
+        self.__dict__["_counter"] = counter
+        self.__dict__.update(attrs)
+
+    def __getattribute__(self, name):
+        if not name.startswith("_"):
+            object.__getattribute__(self, "_counter").hit(f"{type(self).__name__}.{name}")
+        return object.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        if not name.startswith("_"):
+            self._counter.hit(f"{type(self).__name__}.{name}=")
+        self.__dict__[name] = value
+
+
+class _Collection(_ComObject):
+    """1-based COM collection with ``Count``, ``Item`` and enumeration."""
+
+    def __init__(self, counter: CallCounter, items=None):
+        super().__init__(counter, _items=list(items or []))
+
+    @property
+    def Count(self) -> int:
+        return len(self._items)
+
+    def Item(self, index):
+        return self._items[index - 1]
+
+    def __iter__(self):
+        for item in self._items:
+            # Each IEnumVARIANT::Next is a round-trip
+            self._counter.hit(f"{type(self).__name__}.__next__")
+            yield item
+
+
+class FakeExchangeUser(_ComObject):
+    pass
+
+
+class FakeAddressEntry(_ComObject):
+    def GetExchangeUser(self):
+        return self._exchange_user
+
+
+class FakePropertyAccessor(_ComObject):
+    def GetProperty(self, tag):
+        return self._properties.get(tag)
+
+
+class FakeRecipient(_ComObject):
+    def Resolve(self) -> bool:
+        return self._resolvable
+
+
+class FakeRecipients(_Collection):
+    pass
+
+
+class FakeAttachment(_ComObject):
+    def SaveAsFile(self, path) -> None:
+        Path(path).write_bytes(self._payload)
+
+
+class FakeAttachments(_Collection):
+    pass
+
+
+class FakeMailItem(_ComObject):
+    pass
+
+
+_RESTRICT_RE = re.compile(r"\[(\w+)\]\s*(=|>=|<=|>|<)\s*'?([^']*)'?")
+
+
+class FakeItems(_Collection):
+    """``Folder.Items``: supports ``Sort`` and simple ``Restrict`` filters."""
+
+    def Sort(self, field, descending=False) -> None:
+        key = field.strip("[]")
+        self._items.sort(key=lambda item: item.__dict__[key], reverse=bool(descending))
+
+    def Restrict(self, filter_text):
+        """Supports ``[Field] op value`` clauses joined with ``AND``."""
+        items = self._items
+        for clause in re.split(r"\s+AND\s+", filter_text, flags=re.IGNORECASE):
+            match = _RESTRICT_RE.fullmatch(clause.strip())
+            if not match:
+                raise ValueError(f"Unsupported Restrict filter: {clause}")
+            field, op, raw = match.groups()
+            sample = items[0].__dict__[field] if items else None
+            if isinstance(sample, bool):
+                value = raw.strip().lower() == "true"
+            elif isinstance(sample, datetime):
+                value = datetime.strptime(raw.strip(), "%Y-%m-%d %H:%M")
+            else:
+                value = raw
+            compare = {
+                "=": lambda a, b: a == b, ">=": lambda a, b: a >= b, "<=": lambda a, b: a <= b,
+                ">": lambda a, b: a > b, "<": lambda a, b: a < b,
+            }[op]
+            items = [item for item in items if compare(item.__dict__[field], value)]
+        return FakeItems(self._counter, items)
+
+
+class FakeFolder(_ComObject):
+    pass
+
+
+class FakeFolders(_Collection):
+    """Folder collection; ``Item``/call accept a folder name or a 1-based index."""
+
+    def Item(self, key):
+        if isinstance(key, int):
+            return self._items[key - 1]
+        for folder in self._items:
+            if folder.__dict__["Name"] == key:
+                return folder
+        raise KeyError(key)
+
+    def __call__(self, key):
+        self._counter.hit("FakeFolders.__call__")
+        return object.__getattribute__(self, "Item")(key)
+
+
+class FakeNamespace(_ComObject):
+    """``Outlook.Application.GetNamespace("MAPI")``."""
+
+    def CreateRecipient(self, name):
+        address = self._directory.get(name)
+        entry = FakeAddressEntry(self._counter, Type="SMTP", Address=address, _exchange_user=None)
+        return FakeRecipient(self._counter, Name=name, AddressEntry=entry, _resolvable=address is not None)
+
+
+def _make_recipient(counter: CallCounter, rng: random.Random, index: int, exchange_ratio: float, directory: dict):
+    name = f"Supplier {index}"
+    smtp = f"supplier{index}@vendor{index % 97}.com"
+    if rng.random() < exchange_ratio:
+        # Exchange (EX) entry resolved through GetExchangeUser()
+        user = FakeExchangeUser(counter, PrimarySmtpAddress=smtp)
+        entry = FakeAddressEntry(counter, Type="EX", Address=f"/o=ExchangeLabs/cn={name}", _exchange_user=user)
+    else:
+        entry = FakeAddressEntry(counter, Type="SMTP", Address=smtp, _exchange_user=None)
+    directory[name] = smtp
+    accessor = FakePropertyAccessor(counter, _properties={PR_SMTP_ADDRESS: smtp})
+    return FakeRecipient(counter, Type=1, Name=name, AddressEntry=entry, PropertyAccessor=accessor, _resolvable=True)
+
+
+def generate_mailbox(
+    n_messages: int,
+    counter: CallCounter | None = None,
+    account: str = FAKE_ACCOUNT,
+    folder_path: list[str] | None = None,
+    unread_ratio: float = 0.3,
+    pdf_ratio: float = 0.9,
+    recipients_per_message: int = 2,
+    exchange_ratio: float = 0.5,
+    days: int = 365,
+    seed: int = 0,
+) -> FakeNamespace:
+    """
+    Build a fake MAPI namespace holding one folder with ``n_messages`` emails.
+
+    Parameters
+    ----------
+    n_messages : int
+        Number of mail items in the folder (10k–100k for load tests).
+    counter : CallCounter, optional
+        Shared call counter / latency model (a new one with no latency if None).
+    account, folder_path
+        Where the folder lives, as passed to ``read_po_emails_and_save_pdfs``.
+    unread_ratio : float
+        Fraction of messages marked unread.
+    pdf_ratio : float
+        Fraction of messages with a PDF attachment (others carry a .xlsx).
+    recipients_per_message : int
+        Number of TO recipients per message.
+    exchange_ratio : float
+        Fraction of recipients stored as Exchange (``EX``) address entries.
+    days : int
+        Received times are spread over this many days before now.
+    seed : int
+        Random seed, so the same mailbox can be regenerated for comparisons.
+    """
+    counter = counter or CallCounter()
+    folder_path = folder_path or FAKE_FOLDER_PATH
+    rng = random.Random(seed)
+    directory: dict[str, str] = {}
+    now = datetime.now().replace(microsecond=0)
+
+    messages = []
+    for i in range(n_messages):
+        po_number = 4_500_000_000 + i
+        attachments = []
+        if rng.random() < pdf_ratio:
+            payload = _PDF_TEMPLATE + f"%{po_number}\n".encode()
+            attachments.append(FakeAttachment(counter, FileName=f"PO_{po_number}.pdf", _payload=payload))
+        else:
+            attachments.append(FakeAttachment(counter, FileName=f"Quotation_{i}.xlsx", _payload=b"xlsx"))
+        recipients = [
+            _make_recipient(counter, rng, rng.randrange(5000), exchange_ratio, directory)
+            for _ in range(recipients_per_message)
+        ]
+        messages.append(FakeMailItem(
+            counter,
+            Subject=f"ERP PO#{po_number}",
+            UnRead=rng.random() < unread_ratio,
+            ReceivedTime=now - timedelta(seconds=rng.randrange(days * 86400)),
+            Attachments=FakeAttachments(counter, attachments),
+            Recipients=FakeRecipients(counter, recipients),
+        ))
+
+    folder = FakeFolder(counter, Name=folder_path[-1], Items=FakeItems(counter, messages), Folders=FakeFolders(counter))
+    for name in reversed(folder_path[:-1]):
+        folder = FakeFolder(counter, Name=name, Items=FakeItems(counter), Folders=FakeFolders(counter, [folder]))
+    store = FakeFolder(counter, Name=account, Items=FakeItems(counter), Folders=FakeFolders(counter, [folder]))
+    return FakeNamespace(counter, Folders=FakeFolders(counter, [store]), _directory=directory)
+
+
+__all__ = [
+    "FAKE_ACCOUNT",
+    "FAKE_FOLDER_PATH",
+    "CallCounter",
+    "FakeNamespace",
+    "generate_mailbox",
+]
@@ -1,28 +1,31 @@
+import time
+
+_STARTED = time.perf_counter()
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from tkcalendar import DateEntry
 from pathlib import Path
 import threading
-import pythoncom
-import win32com.client
-from m01_email_reader import read_po_emails_and_save_pdfs
-from m02_pdf_scan import process_po_pdfs, merge_thread_logs
-from m03_send_request_email import send_email_outlook, load_log
-import pandas as pd
-import os
-from config import TEMP_DIR, LOG_DIR, MAX_WORKERS
+from config import ENTITY_SHORT_NAMES
 from datetime import datetime
-import concurrent.futures
-import time
 
-ENTITY_SHORT_NAMES = {
-    "GREEN PLANET DISTRIBUTION CENTRE COMPANY LIMITED": "GREEN PLANET",
-    "TECHTRONIC TOOLS (VIETNAM) COMPANY LIMITED": "TTI TOOLS",
-    "TECHTRONIC PRODUCTS (VIETNAM) COMPANY LIMITED": "TTI PRODUCTS",
-    "TECHTRONIC INDUSTRIES VIETNAM MANUFACTURING COMPANY LIMITED": "TTIVN MFG",
-    "TECHTRONIC INDUSTRIES VIETNAM MANUFACTURING COMPANY LIMITED – BRANCH IN DAU GIAY INDUSTRIAL PARK": "TTIVN MFG - CNDG"
-}
+# pandas, pdfplumber (m02), win32com (m01/m03), jinja2 (m03) and tkcalendar are
+# imported by warm_up() in a background thread once the window is shown, and
+# imported locally where they are used (a no-op once warm-up is done).
+
+
+def warm_up() -> float:
+    """Import the heavy modules, load the supplier list and start two scan workers."""
+    started = time.perf_counter()
+    import pandas  # noqa: F401
+    import tkcalendar  # noqa: F401
+    import m01_email_reader  # noqa: F401
+    import m03_send_request_email  # noqa: F401
+    import summary_stats  # noqa: F401
+    import m02_pdf_scan
+    m02_pdf_scan.warm_up()
+    return time.perf_counter() - started
+
 
 class POApp:
     def __init__(self, root):
@@ -39,11 +42,11 @@ class POApp:
         self.user_account_var = tk.StringVar()
         tk.Entry(self.input_frame, textvariable=self.user_account_var, width=40).grid(row=0, column=1, padx=5, pady=2)
 
-        tk.Label(self.input_frame, text="User Email:").grid(row=1, column=0, sticky="e")
+        tk.Label(self.input_frame, text="User Email(s):").grid(row=1, column=0, sticky="e")
         self.user_email_var = tk.StringVar()
         tk.Entry(self.input_frame, textvariable=self.user_email_var, width=40).grid(row=1, column=1, padx=5, pady=2)
 
-        tk.Label(self.input_frame, text="Email Folder Path:").grid(row=2, column=0, sticky="e")
+        tk.Label(self.input_frame, text="Email Folder Path(s):").grid(row=2, column=0, sticky="e")
         self.folder_path_var = tk.StringVar()
         tk.Entry(self.input_frame, textvariable=self.folder_path_var, width=40).grid(row=2, column=1, padx=5, pady=2)
 
@@ -52,33 +55,17 @@ class POApp:
         self.max_emails_var = tk.IntVar(value=100)
         tk.Entry(self.input_frame, textvariable=self.max_emails_var, width=10).grid(row=3, column=1, sticky="w", padx=5)
         self.from_date_var = tk.StringVar()
-        self.from_date_var = tk.StringVar()
-        self.date_entry = DateEntry(
-            self.input_frame,
-            textvariable=self.from_date_var,
-            date_pattern="yyyy-mm-dd",
-            width=12
-        )
-        self.date_entry.delete(0, "end")  # ✅ Cho phép trống
+        # Plain entry (yyyy-mm-dd) until tkcalendar is loaded by the warm-up
+        self.date_entry = tk.Entry(self.input_frame, textvariable=self.from_date_var, width=12)
         self.date_entry.grid(row=3, column=3, padx=5)
         tk.Button(self.input_frame, text="Clear", command=lambda: self.date_entry.delete(0, "end")).grid(row=3, column=4, padx=5)
-        # Cho phép xóa ngày khi người dùng backspace hoặc clear nội dung
-        def on_date_focus_out(event):
-            if not self.from_date_var.get().strip():
-                self.date_entry.delete(0, "end")
-
-        def allow_delete(event):
-            if event.keysym in ("BackSpace", "Delete"):
-                self.date_entry.delete(0, "end")
-
-        self.date_entry.bind("<FocusOut>", on_date_focus_out)
-        self.date_entry.bind("<Key>", allow_delete)
 
         tk.Label(self.input_frame, text="Output Folder:").grid(row=4, column=0, sticky="e")
         self.output_folder_var = tk.StringVar()
         tk.Entry(self.input_frame, textvariable=self.output_folder_var, width=40).grid(row=4, column=1, padx=5, pady=2)
         tk.Button(self.input_frame, text="Browse", command=self.browse_output_folder).grid(row=4, column=2)
         tk.Button(self.input_frame, text="Fetch Emails", command=self.fetch_emails).grid(row=4, column=3, padx=5)
+        tk.Button(self.input_frame, text="Retry Failed", command=self.retry_failed).grid(row=4, column=4, padx=5)
 
         self.email_frame = tk.LabelFrame(self.top_frame, text="Send Request Email")
         self.email_frame.pack(side="right", fill="y", padx=5, pady=5)
@@ -90,12 +77,15 @@ class POApp:
         self.entity_filter_combo.current(0)
         self.entity_filter_combo.pack(padx=5, pady=2, fill="x")
 
+        self.batch_email_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.email_frame, text="One email per supplier", variable=self.batch_email_var).pack(padx=5, anchor="w")
         tk.Button(self.email_frame, text="Send Email for Selected", command=self.send_email_selected).pack(pady=2, fill="x", padx=5)
+        tk.Button(self.email_frame, text="History Report", command=self.show_history_report).pack(pady=2, fill="x", padx=5)
 
         self.summary_frame = tk.LabelFrame(root, text="Summary of PO Scan")
         self.summary_frame.pack(fill="x", padx=10, pady=5)
 
-        self.summary_text = tk.Text(self.summary_frame, height=8, wrap="word", state="disabled", bg=self.root.cget("bg"), relief="flat")
+        self.summary_text = tk.Text(self.summary_frame, height=12, wrap="word", state="disabled", bg=self.root.cget("bg"), relief="flat")
         self.summary_text.pack(fill="x", padx=10, pady=5)
 
         self.status_var = tk.StringVar()
@@ -105,6 +95,76 @@ class POApp:
         self.email_results = []
         self.output_base_path = None
 
+        # Startup instrumentation: time to first idle after the window is built,
+        # and duration of the background warm-up
+        self.startup_times = {}
+        self._warm_up_done = threading.Event()
+        self._warm_up_error = None
+        self.root.after_idle(self._on_window_shown)
+
+    def _on_window_shown(self):
+        self.startup_times["window"] = time.perf_counter() - _STARTED
+        print(f"🪟 Window shown after {self.startup_times['window']:.2f}s")
+        self.status_var.set("⏳ Loading modules in background...")
+        threading.Thread(target=self._warm_up_thread, daemon=True).start()
+        self.root.after(100, self._poll_warm_up)
+
+    def _warm_up_thread(self):
+        try:
+            self.startup_times["warm_up"] = warm_up()
+        except Exception as e:
+            self._warm_up_error = e
+        finally:
+            self._warm_up_done.set()
+
+    def _poll_warm_up(self):
+        # Tk widgets must be created on the main thread, so poll from the event loop
+        if not self._warm_up_done.is_set():
+            self.root.after(100, self._poll_warm_up)
+            return
+        if self._warm_up_error is not None:
+            self.status_var.set(f"Error while loading modules: {self._warm_up_error}")
+            return
+        self._install_date_entry()
+        print(f"🔥 Warm-up done in {self.startup_times['warm_up']:.2f}s")
+        self.status_var.set(
+            f"Ready (window {self.startup_times['window']:.2f}s, warm-up {self.startup_times['warm_up']:.2f}s)"
+        )
+
+    def _install_date_entry(self):
+        """Replace the plain date entry with the calendar widget, keeping the typed value."""
+        from tkcalendar import DateEntry
+
+        typed = self.from_date_var.get().strip()
+        self.date_entry.destroy()
+        self.date_entry = DateEntry(
+            self.input_frame,
+            textvariable=self.from_date_var,
+            date_pattern="yyyy-mm-dd",
+            width=12
+        )
+        self.date_entry.delete(0, "end")  # ✅ Cho phép trống
+        if typed:
+            self.date_entry.insert(0, typed)
+        self.date_entry.grid(row=3, column=3, padx=5)
+        # Cho phép xóa ngày khi người dùng backspace hoặc clear nội dung
+        def on_date_focus_out(event):
+            if not self.from_date_var.get().strip():
+                self.date_entry.delete(0, "end")
+
+        def allow_delete(event):
+            if event.keysym in ("BackSpace", "Delete"):
+                self.date_entry.delete(0, "end")
+
+        self.date_entry.bind("<FocusOut>", on_date_focus_out)
+        self.date_entry.bind("<Key>", allow_delete)
+
+    def _startup_summary(self) -> str:
+        if "warm_up" not in self.startup_times:
+            return ""
+        return (f"Startup: window {self.startup_times['window']:.2f}s, "
+                f"warm-up {self.startup_times['warm_up']:.2f}s\n")
+
     def browse_output_folder(self):
         folder_selected = filedialog.askdirectory()
         if folder_selected:
@@ -115,6 +175,14 @@ class POApp:
         threading.Thread(target=self._fetch_emails_thread).start()
 
     def _fetch_emails_thread(self):
+        if not self._warm_up_done.is_set():
+            self.status_var.set("⏳ Waiting for modules to load...")
+            self._warm_up_done.wait()
+        import pythoncom
+        from m01_email_reader import read_po_emails_from_sources, build_sources
+        from m02_pdf_scan import process_po_pdfs, merge_thread_logs
+        from summary_stats import get_counters
+
         pythoncom.CoInitialize()
         try:
             start = time.perf_counter()
@@ -123,44 +191,50 @@ class POApp:
             from_date = datetime.strptime(from_date_str, "%Y-%m-%d") if from_date_str else None
 
 
-            email_account = self.user_email_var.get().strip()
-            folder_path_str = self.folder_path_var.get().strip()
-            folder_path = [seg.strip() for seg in folder_path_str.split(">") if seg.strip()]
+            # Several accounts / folder paths can be entered separated by ";"
+            sources = build_sources(self.user_email_var.get(), self.folder_path_var.get())
 
-            self.status_var.set("📥 Fetching emails and saving PDFs...")
+            self.status_var.set(f"📥 Fetching emails and saving PDFs from {len(sources)} source(s)...")
             temp_dir = self.output_base_path / "temp"
 
-            self.email_results = read_po_emails_and_save_pdfs(
+            source_errors = []
+            self.email_results = read_po_emails_from_sources(
                 temp_dir,
-                email_account=email_account,
-                folder_path=folder_path,
+                sources,
                 max_emails=max_emails,
-                from_date=from_date
+                from_date=from_date,
+                errors=source_errors
             )
 
             self.status_var.set("📄 Scanning PDF content...")
-            process_po_pdfs(self.email_results, self.output_base_path)
+            scan_stats = process_po_pdfs(self.email_results, self.output_base_path)
 
             self.status_var.set("📝 Merging thread logs...")
             log_path, count = merge_thread_logs(self.output_base_path)
-            df_log = pd.read_csv(log_path, dtype=str)
 
+            # Read the materialized counters instead of re-reading the whole log
             self.status_var.set("📊 Generating summary...")
-            cd_needed = df_log[df_log["Need_CDs"] == "Yes"]
-            entity_counts = {}
-            for _, row in cd_needed.iterrows():
-                buyer = row.get("Buyer", "").strip()
-                entity = ENTITY_SHORT_NAMES.get(buyer, buyer if buyer else "Unknown")
-                entity_counts[entity] = entity_counts.get(entity, 0) + 1
+            totals = get_counters(self.output_base_path).totals()
+            entity_counts = {k: v["Need_CDs_Yes"] for k, v in totals.items() if v["Need_CDs_Yes"]}
+            pending = sum(v["Emails_Pending"] for v in totals.values())
 
             elapsed = time.perf_counter() - start
-            summary = f"✅ Time Elapsed: {elapsed:.1f}s\nPO total: {len(self.email_results)}\nPO CDs Required:\n"
+            rejected = scan_stats["rejected"]
+            summary = f"✅ Time Elapsed: {elapsed:.1f}s\nPO total: {len(self.email_results)}\n"
+            summary += f"Non-PO skipped: {sum(rejected.values())}"
+            summary += f" ({', '.join(f'{k}: {v}' for k, v in rejected.items())})\n" if rejected else "\n"
+            summary += f"Failed: {scan_stats['failed']}\nEmails pending: {pending}\nPO CDs Required:\n"
             summary += "\n".join(f"{k}: {v}" for k, v in entity_counts.items()) if entity_counts else "(None)"
+            summary = self._startup_summary() + summary
+            if source_errors:
+                summary = "".join(f"❌ {source}: {error}\n" for source, error in source_errors) + summary
             self.summary_text.config(state="normal")
             self.summary_text.delete("1.0", tk.END)
             self.summary_text.insert(tk.END, summary)
             self.summary_text.config(state="disabled")
-            self.status_var.set("✅ Done.")
+            self.status_var.set(
+                f"⚠️ Done, {len(source_errors)} source(s) failed." if source_errors else "✅ Done."
+            )
 
         except Exception as e:
             self.status_var.set(f"Error: {e}")
@@ -169,34 +243,80 @@ class POApp:
         except Exception as e:
             self.status_var.set(f"Error: {e}")
 
+    def retry_failed(self):
+        self.output_base_path = Path(self.output_folder_var.get())
+        threading.Thread(target=self._retry_failed_thread).start()
+
+    def _retry_failed_thread(self):
+        self._warm_up_done.wait()
+        from m02_pdf_scan import merge_thread_logs, retry_failed_pdfs
+
+        try:
+            self.status_var.set("🔁 Retrying failed PDFs from quarantine...")
+            remaining = retry_failed_pdfs(self.output_base_path)
+            merge_thread_logs(self.output_base_path)
+            self.status_var.set(f"✅ Retry done. Still failing: {remaining}")
+        except Exception as e:
+            self.status_var.set(f"Error: {e}")
+
     def send_email_selected(self):
         self.output_base_path = Path(self.output_folder_var.get())
+        selected_entity = self.entity_filter_var.get().strip().upper()
+        # Already imported by the warm-up unless the user clicks right away
+        from m03_send_request_email import (
+            send_email_outlook, send_emails_batched, load_log, filter_by_entity, record_emails_sent
+        )
+
         df = load_log(self.output_base_path)
         if df is None:
             messagebox.showerror("Log Missing", "Log file not found.")
             return
 
-        selected_entity = self.entity_filter_var.get().strip().upper()
         df_filtered = df[(df["Need_CDs"] == "Yes") & (df["Email Request Info"] != "Yes")]
-
-        sent = 0
-        for _, row in df_filtered.iterrows():
-            short_name = ENTITY_SHORT_NAMES.get(row.get("Buyer", ""), "").upper()
-            if selected_entity != "ALL" and selected_entity != short_name:
-                continue
-
-            result = send_email_outlook(row, self.output_base_path)
-            if result:  # only True if mail.Send() succeeds
-                sent += 1
-                df.loc[(df["PO Number"] == row["PO Number"]), "Email Request Info"] = "Yes"
+        df_filtered = filter_by_entity(df_filtered, selected_entity)
+
+        sent_rows = []
+        if self.batch_email_var.get():
+            # One email per supplier address set and entity
+            sent_rows = send_emails_batched(df_filtered, self.output_base_path)
+            sent_pos = [row["PO Number"] for row in sent_rows]
+            df.loc[df["PO Number"].isin(sent_pos), "Email Request Info"] = "Yes"
+        else:
+            for _, row in df_filtered.iterrows():
+                result = send_email_outlook(row, self.output_base_path)
+                if result:  # only True if mail.Send() succeeds
+                    sent_rows.append(row.to_dict())
+                    df.loc[(df["PO Number"] == row["PO Number"]), "Email Request Info"] = "Yes"
+        sent = len(sent_rows)
 
         # ⏳ Đảm bảo log được cập nhật sau vòng lặp
         log_file = self.output_base_path / "log" / "po_log.csv"
         df.to_csv(log_file, index=False, encoding="utf-8", quoting=1)
+        record_emails_sent(self.output_base_path, sent_rows)
 
         messagebox.showinfo("Done", f"Sent {sent} emails.")
         self.status_var.set(f"Sent {sent} emails.")
 
+    def show_history_report(self):
+        """Monthly counters per entity, read from the summary counters only."""
+        from summary_stats import get_counters
+
+        self.output_base_path = Path(self.output_folder_var.get())
+        from_date = self.from_date_var.get().strip() or None
+        entity = self.entity_filter_var.get().strip()
+        report = get_counters(self.output_base_path).query(
+            start=from_date,
+            entity=None if entity.upper() == "ALL" else entity,
+            by="month",
+        )
+
+        window = tk.Toplevel(self.root)
+        window.title("PO History Report (by month)")
+        text = tk.Text(window, width=110, height=25, wrap="none")
+        text.pack(fill="both", expand=True, padx=10, pady=10)
+        text.insert(tk.END, report.to_string(index=False) if not report.empty else "(No data)")
+        text.config(state="disabled")
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = POApp(root)
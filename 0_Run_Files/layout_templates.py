@@ -0,0 +1,251 @@
+"""Learned per-buyer layout templates for line-item table extraction.
+
+Every PO from the same ERP and buyer entity has the same layout, yet
+``page.extract_tables()`` searched the whole page for table structure every
+time. The scanner now learns, per buyer and page size, the bounding box of the
+line-item grid, its column boundaries and the column index of UOM and Unit
+Price. Later documents crop to that region and use explicit column lines; when
+the cropped result does not validate (header columns not where expected), the
+page falls back to full detection and the template is re-learned.
+
+The region ends at the bottom of the grid on each page, found by following the
+grid's left border rule down from its top, so ruled blocks under the grid
+(totals, signatures) are not read as line items. A template is only learned
+when extracting with it reproduces the rows of full detection on the page it
+is learned from; ``compare_with_full_detection`` runs the same check on any
+page for regression testing.
+
+Templates are stored in ``log/layout_templates.json``.
+"""
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+
+# Gap (pt) bridged between rule segments, as pdfplumber's join tolerance
+EDGE_TOLERANCE = 3.0
+
+
+def _find_columns(header) -> tuple[int | None, int | None]:
+    """Index of the UOM and Unit Price columns in a table header row."""
+    uom_col = price_col = None
+    for i, h in enumerate(header or []):
+        if not isinstance(h, str):
+            continue
+        low = h.lower()
+        if uom_col is None and "uom" in low:
+            uom_col = i
+        if price_col is None and "unit" in low and "price" in low:
+            price_col = i
+    return uom_col, price_col
+
+
+def layout_key(buyer_folder: str, page) -> str | None:
+    """Template key: buyer folder name plus page size (``None`` if buyer unknown)."""
+    if not buyer_folder or buyer_folder == "Unknown":
+        return None
+    return f"{buyer_folder}|{round(page.width)}x{round(page.height)}"
+
+
+def _line_item_table(found_tables, tables):
+    """First ``(table_obj, rows)`` whose header has UOM and Unit Price columns, or None."""
+    for table_obj, table in zip(found_tables, tables):
+        if not table:
+            continue
+        uom_col, price_col = _find_columns(table[0])
+        if uom_col is not None and price_col is not None:
+            return table_obj, table
+    return None
+
+
+def learn_from_tables(page, found_tables, tables, page_index: int) -> dict | None:
+    """
+    Build a template from the tables found by full detection on one page.
+
+    Only a table whose header row contains both a UOM and a Unit Price column
+    is learned, and only if extracting with the new template reproduces that
+    table's rows on this page. ``top_first`` is learned from the first page of
+    a PO and ``top_rest`` from continuation pages, since the grid starts lower
+    on the first page (below the PO header block).
+    """
+    found = _line_item_table(found_tables, tables)
+    if found is None:
+        return None
+    table_obj, table = found
+    uom_col, price_col = _find_columns(table[0])
+    x0, top, x1, _ = table_obj.bbox
+    columns = sorted({round(cell[0], 1) for cell in table_obj.cells} | {round(x1, 1)})
+    learned = {
+        "x0": round(x0, 1),
+        "x1": round(x1, 1),
+        "top_first" if page_index == 0 else "top_rest": round(top, 1),
+        "columns": columns,
+        "uom_col": uom_col,
+        "price_col": price_col,
+    }
+    extracted = extract_with_template(page, learned, page_index)
+    if not extracted or extracted[0] != table:
+        return None
+    return learned
+
+
+def _same_grid(a: dict, b: dict) -> bool:
+    """Same UOM/price columns and column rules within ``EDGE_TOLERANCE``."""
+    if a.get("uom_col") != b.get("uom_col") or a.get("price_col") != b.get("price_col"):
+        return False
+    columns_a, columns_b = a.get("columns") or [], b.get("columns") or []
+    return len(columns_a) == len(columns_b) and all(
+        abs(x - y) <= EDGE_TOLERANCE for x, y in zip(columns_a, columns_b)
+    )
+
+
+def _grid_bottom(region, x0: float, top: float) -> float | None:
+    """
+    Bottom of the grid whose left border is at ``x0``, starting at ``top``.
+
+    Follows the vertical rule segments of the border down while they connect,
+    so a separate block below the grid (even at the same x) ends the grid.
+    """
+    segments = sorted(
+        (edge["top"], edge["bottom"]) for edge in region.edges
+        if edge["orientation"] == "v" and abs(edge["x0"] - x0) <= EDGE_TOLERANCE
+    )
+    bottom = None
+    for seg_top, seg_bottom in segments:
+        if bottom is None:
+            if abs(seg_top - top) > EDGE_TOLERANCE:
+                continue
+        elif seg_top > bottom + EDGE_TOLERANCE:
+            break
+        bottom = seg_bottom if bottom is None else max(bottom, seg_bottom)
+    return bottom
+
+
+def extract_with_template(page, template: dict, page_index: int):
+    """
+    Extract tables from the template region only; ``None`` if it does not validate.
+    """
+    top = template.get("top_first" if page_index == 0 else "top_rest")
+    if top is None:
+        return None
+    x0 = max(template["x0"] - 1, 0)
+    x1 = min(template["x1"] + 1, page.width)
+    if top >= page.height or x0 >= x1:
+        return None
+    # within_bbox filters objects without clipping them, cheaper than crop()
+    region = page.within_bbox((x0, max(top - 1, 0), x1, page.height))
+    bottom = _grid_bottom(region, template["x0"], top)
+    if bottom is None:
+        return None
+    region = region.within_bbox((x0, max(top - 1, 0), x1, min(bottom + 1, page.height)))
+    tables = region.extract_tables({
+        "vertical_strategy": "explicit",
+        "explicit_vertical_lines": template["columns"],
+        "horizontal_strategy": "lines",
+    })
+    if not tables or not tables[0]:
+        return None
+    header = tables[0][0]
+    uom_col, price_col = _find_columns(header)
+    if uom_col != template["uom_col"] or price_col != template["price_col"]:
+        return None
+    return tables
+
+
+def extract_page_tables(page, template: dict | None, page_index: int):
+    """
+    Return ``(tables, learned)`` for one page.
+
+    Uses the template region when it validates; otherwise runs full table
+    detection (equivalent to ``page.extract_tables()``) and returns what could
+    be learned from it, or ``None``.
+    """
+    if template:
+        tables = extract_with_template(page, template, page_index)
+        if tables is not None:
+            return tables, None
+    found_tables = page.find_tables()
+    tables = [table.extract() for table in found_tables]
+    return tables, learn_from_tables(page, found_tables, tables, page_index)
+
+
+def compare_with_full_detection(page, template: dict, page_index: int):
+    """
+    Check ``template`` against full table detection on one page.
+
+    Intended for regression testing the templates on a corpus of POs.
+    Returns ``(full_rows, template_rows)`` of the line-item table when the
+    template extracts different rows, or None when they agree or the template
+    does not validate on this page (the scan then falls back to full detection).
+    """
+    tables = extract_with_template(page, template, page_index)
+    if tables is None:
+        return None
+    found_tables = page.find_tables()
+    found = _line_item_table(found_tables, [table.extract() for table in found_tables])
+    full_rows = found[1] if found else None
+    if tables[0] == full_rows:
+        return None
+    return full_rows, tables[0]
+
+
+class LayoutTemplateStore:
+    """Thread-safe cache of layout templates backed by a JSON file."""
+
+    def __init__(self, output_base_dir):
+        self.path = Path(output_base_dir) / "log" / "layout_templates.json"
+        self._lock = threading.Lock()
+        self._templates: dict[str, dict] = {}
+        self._dirty = False
+        if self.path.exists():
+            try:
+                self._templates = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._templates = {}
+
+    def get(self, key: str | None) -> dict | None:
+        if key is None:
+            return None
+        with self._lock:
+            template = self._templates.get(key)
+            return dict(template) if template else None
+
+    def snapshot(self) -> dict[str, dict]:
+        """Copy of all templates, e.g. to hand to scan worker processes."""
+        with self._lock:
+            return {key: dict(template) for key, template in self._templates.items()}
+
+    def learn(self, key: str | None, learned: dict | None) -> None:
+        """Merge a learned (partial) template into the one stored for ``key``."""
+        if key is None or not learned:
+            return
+        with self._lock:
+            current = self._templates.get(key)
+            same_grid = current and _same_grid(current, learned)
+            if same_grid:
+                merged = {**current, **learned}
+            else:
+                # New or changed layout: start over from the learned grid
+                merged = dict(learned)
+            if merged != current:
+                self._templates[key] = merged
+                self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self._templates, indent=2, ensure_ascii=False), encoding="utf-8")
+            self._dirty = False
+
+
+__all__ = [
+    "layout_key",
+    "learn_from_tables",
+    "extract_with_template",
+    "compare_with_full_detection",
+    "extract_page_tables",
+    "LayoutTemplateStore",
+]
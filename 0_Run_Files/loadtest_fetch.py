@@ -0,0 +1,87 @@
+"""Load test of the email fetch stage against a simulated Outlook mailbox.
+
+Runs ``read_po_emails_and_save_pdfs`` on a mailbox generated by
+``fake_outlook`` (no Outlook or Windows needed) and reports elapsed time and
+COM round-trips, in total and per processed message. With ``--budget`` the run
+fails when the calls per processed message exceed the budget, which catches
+regressions in the number of COM calls.
+
+Usage:
+    python loadtest_fetch.py --messages 10000 --latency 0.0002 --max-emails 100 --budget 60
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+
+from fake_outlook import FAKE_ACCOUNT, FAKE_FOLDER_PATH, CallCounter, generate_mailbox
+from m01_email_reader import read_po_emails_and_save_pdfs
+
+
+def run_fetch_load_test(
+    n_messages: int,
+    latency: float = 0.0,
+    max_emails: int = 100,
+    unread_ratio: float = 0.3,
+    seed: int = 0,
+) -> dict:
+    """
+    Fetch from a generated mailbox and return timing and COM call statistics.
+
+    Returns
+    -------
+    dict
+        ``messages``, ``processed`` (PDFs saved), ``elapsed`` (seconds),
+        ``calls`` (total COM round-trips), ``calls_per_message`` (per processed
+        PDF) and ``top_calls`` (the most frequent calls).
+    """
+    counter = CallCounter()
+    outlook = generate_mailbox(n_messages, counter=counter, unread_ratio=unread_ratio, seed=seed)
+    # Latency is switched on only after the mailbox is built
+    counter.latency = latency
+
+    with tempfile.TemporaryDirectory(prefix="po_fetch_loadtest_") as save_folder:
+        started = time.perf_counter()
+        results = read_po_emails_and_save_pdfs(
+            save_folder, FAKE_ACCOUNT, FAKE_FOLDER_PATH, max_emails=max_emails, outlook=outlook
+        )
+        elapsed = time.perf_counter() - started
+
+    processed = len(results)
+    return {
+        "messages": n_messages,
+        "processed": processed,
+        "elapsed": elapsed,
+        "calls": counter.total,
+        "calls_per_message": counter.total / processed if processed else float(counter.total),
+        "top_calls": counter.by_name.most_common(10),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000, help="mailbox size")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per simulated COM call")
+    parser.add_argument("--max-emails", type=int, default=100, help="max unread emails per run")
+    parser.add_argument("--unread-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=float, default=None, help="max COM calls per processed message")
+    args = parser.parse_args(argv)
+
+    report = run_fetch_load_test(args.messages, args.latency, args.max_emails, args.unread_ratio, args.seed)
+    print(f"📬 Mailbox: {report['messages']} emails, processed {report['processed']} PDF")
+    print(f"⏱️ Elapsed: {report['elapsed']:.2f}s")
+    print(f"🔁 COM calls: {report['calls']} ({report['calls_per_message']:.1f} / processed message)")
+    for name, count in report["top_calls"]:
+        print(f"   {name}: {count}")
+
+    if args.budget is not None and report["calls_per_message"] > args.budget:
+        print(f"❌ COM calls per message {report['calls_per_message']:.1f} > budget {args.budget}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,22 @@
-import win32com.client
 import os
 import gc
-import pythoncom
+import hashlib
+import concurrent.futures
+from pathlib import Path
 from datetime import datetime
 
+try:
+    import pythoncom  # type: ignore[import]
+except ImportError:  # non-Windows hosts, e.g. load tests with fake_outlook
+    pythoncom = None
+
 # Note: PDF scanning and classification have been moved to m02_pdf_scan.process_po_pdfs
 # to avoid redundant work. read_po_emails_and_save_pdfs now only downloads PDF
 # attachments and collects basic email metadata. See improvement.txt items 1–3, 12.
 
 from utils import resolve_email  # moved to utils.py to avoid duplication
 
-def read_po_emails_and_save_pdfs(save_folder, email_account, folder_path, max_emails: int = 100, from_date: datetime | None = None):
+def read_po_emails_and_save_pdfs(save_folder, email_account, folder_path, max_emails: int = 100, from_date: datetime | None = None, outlook=None):
     """
     Download PDF attachments from unread emails in the specified Outlook folder.
 
@@ -31,35 +37,42 @@ def read_po_emails_and_save_pdfs(save_folder, email_account, folder_path, max_em
         Maximum number of unread emails to process.
     from_date : datetime, optional
         Only process emails received on or after this date.
+    outlook : COM object, optional
+        Outlook MAPI namespace to use. Defaults to the local Outlook
+        application; ``fake_outlook`` namespaces can be passed for load tests.
 
     Returns
     -------
     list[dict]
         A list of dictionaries containing basic metadata for each downloaded PDF.
     """
-    import os
-    import gc
-    import pythoncom
-    import win32com.client
-
     os.makedirs(save_folder, exist_ok=True)
 
-    outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+    if outlook is None:
+        import win32com.client  # type: ignore[import]
+        outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
     folder = outlook.Folders.Item(email_account)
     for name in folder_path:
         folder = folder.Folders(name)
     erp_po_folder = folder
 
-    messages = erp_po_folder.Items
+    # Let Outlook filter unread mail instead of reading UnRead on every item,
+    # then walk newest first and stop at max_emails or the first older email.
+    # ReceivedTime is compared here because Restrict date literals depend on
+    # the Windows locale.
+    messages = erp_po_folder.Items.Restrict("[UnRead] = True")
     messages.Sort("[ReceivedTime]", True)
+    naive_from_date = from_date.replace(tzinfo=None) if from_date else None
 
-    # Filter by date if provided
-    if from_date:
-        naive_from_date = from_date.replace(tzinfo=None)
-        filtered_messages = [msg for msg in messages if msg.UnRead and msg.ReceivedTime.replace(tzinfo=None) >= naive_from_date]
-    else:
-        filtered_messages = [msg for msg in messages if msg.UnRead]
-    unread_messages = filtered_messages[:max_emails]
+    # Collected before processing: marking a message read removes it from the
+    # restricted collection, which would skip items during iteration
+    unread_messages = []
+    for msg in messages:
+        if len(unread_messages) >= max_emails:
+            break
+        if naive_from_date and msg.ReceivedTime.replace(tzinfo=None) < naive_from_date:
+            break
+        unread_messages.append(msg)
 
     results: list[dict] = []
 
@@ -110,7 +123,171 @@ def read_po_emails_and_save_pdfs(save_folder, email_account, folder_path, max_em
                 msg.UnRead = False  # mark as read
             except Exception:
                 pass
-            pythoncom.CoFreeUnusedLibraries()
+            if pythoncom is not None:
+                pythoncom.CoFreeUnusedLibraries()
             gc.collect()
 
     return results
+
+
+def build_sources(accounts: str, folder_paths: str) -> list[tuple[str, list[str]]]:
+    """
+    Pair mailbox accounts with folder paths entered as ``;``-separated lists.
+
+    A single account is combined with every folder path, a single folder path
+    with every account; otherwise accounts and folder paths are paired in
+    order and must have the same length. A blank folder path reads the root
+    folder of each account, as a single-mailbox setup always did.
+
+    Example:
+    >>> build_sources("a@ttigroup.com.vn; b@ttigroup.com.vn", "CUS > CUS MACHINE > ERP PO")
+    [('a@ttigroup.com.vn', ['CUS', 'CUS MACHINE', 'ERP PO']), ('b@ttigroup.com.vn', ['CUS', 'CUS MACHINE', 'ERP PO'])]
+    """
+    account_list = [a.strip() for a in (accounts or "").split(";") if a.strip()]
+    folder_list = [
+        [seg.strip() for seg in path.split(">") if seg.strip()]
+        for path in (folder_paths or "").split(";") if path.strip()
+    ]
+    if not account_list:
+        raise ValueError("Chưa nhập email account.")
+    if not folder_list:
+        return [(account, []) for account in account_list]
+    if len(account_list) == 1:
+        return [(account_list[0], path) for path in folder_list]
+    if len(folder_list) == 1:
+        return [(account, folder_list[0]) for account in account_list]
+    if len(account_list) != len(folder_list):
+        raise ValueError("Số lượng email account và folder path không khớp nhau.")
+    return list(zip(account_list, folder_list))
+
+def _file_digest(path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def dedupe_email_results(results: list[dict]) -> list[dict]:
+    """
+    Drop PDFs downloaded more than once across sources.
+
+    Duplicates are detected by file content, so the same PO attachment found in
+    a shared mailbox and in a personal ERP PO folder is scanned only once. The
+    first occurrence is kept, the TO addresses of all occurrences are merged
+    into it and the duplicate files are deleted.
+    """
+    unique: dict[str, dict] = {}
+    for res in results:
+        try:
+            key = _file_digest(res["pdf_path"])
+        except OSError:
+            key = res["pdf_path"]
+        kept = unique.get(key)
+        if kept is None:
+            unique[key] = res
+            continue
+        to_emails = [e for e in kept.get("to_emails", "").split(" / ") if e]
+        for email in res.get("to_emails", "").split(" / "):
+            if email and email not in to_emails:
+                to_emails.append(email)
+        kept["to_emails"] = " / ".join(to_emails)
+        try:
+            os.remove(res["pdf_path"])
+        except OSError:
+            pass
+    return list(unique.values())
+
+class SourceFetchError(Exception):
+    """Raised when no mailbox source could be read; ``errors`` lists each failure."""
+
+    def __init__(self, errors: list[tuple[str, Exception]]):
+        self.errors = errors
+        super().__init__("; ".join(f"{source}: {error}" for source, error in errors))
+
+def read_po_emails_from_sources(save_folder, sources, max_emails: int = 100, from_date: datetime | None = None, max_workers: int | None = None, outlook_factory=None, errors: list | None = None):
+    """
+    Fetch PDF attachments from several (account, folder) sources concurrently.
+
+    Each source is read by ``read_po_emails_and_save_pdfs`` in its own thread
+    with its own COM apartment and Outlook namespace, and saves into its own
+    sub-folder of ``save_folder`` so filename collisions between sources cannot
+    race. The per-source results are merged into one scan batch and
+    de-duplicated with ``dedupe_email_results``.
+
+    Parameters
+    ----------
+    save_folder : str or Path
+        Directory where attachments will be saved.
+    sources : list[tuple[str, list[str]]]
+        ``(email_account, folder_path)`` pairs, e.g. from ``build_sources``.
+    max_emails : int, optional
+        Maximum number of unread emails to process per source.
+    from_date : datetime, optional
+        Only process emails received on or after this date.
+    max_workers : int, optional
+        Maximum number of sources fetched at the same time (default: all).
+    outlook_factory : callable, optional
+        Returns the Outlook namespace for one source thread (default: the
+        local Outlook application, see ``read_po_emails_and_save_pdfs``).
+    errors : list, optional
+        Receives a ``(source_name, exception)`` pair for every source that
+        failed while the others succeeded.
+
+    Returns
+    -------
+    list[dict]
+        Merged metadata for each downloaded PDF; every entry also carries a
+        ``source`` key naming the mailbox folder it came from.
+
+    Raises
+    ------
+    SourceFetchError
+        If every source failed (e.g. a mistyped account or folder).
+    """
+    sources = list(sources)
+    if not sources:
+        return []
+    save_folder = Path(save_folder)
+
+    def fetch_source(index: int, email_account: str, folder_path: list[str]) -> list[dict]:
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            source_results = read_po_emails_and_save_pdfs(
+                save_folder / f"source_{index}",
+                email_account,
+                folder_path,
+                max_emails=max_emails,
+                from_date=from_date,
+                outlook=outlook_factory() if outlook_factory else None,
+            )
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+        source_name = " > ".join([email_account, *folder_path])
+        for res in source_results:
+            res["source"] = source_name
+        return source_results
+
+    merged: list[dict] = []
+    failures: list[tuple[str, Exception]] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(sources)) as executor:
+        futures = [
+            executor.submit(fetch_source, i, account, folder_path)
+            for i, (account, folder_path) in enumerate(sources)
+        ]
+        # Collect in source order so de-duplication keeps the first source
+        for (account, folder_path), future in zip(sources, futures):
+            try:
+                merged.extend(future.result())
+            except Exception as e:
+                # One unreachable mailbox must not fail the whole batch
+                source_name = " > ".join([account, *folder_path])
+                print(f"❌ Lỗi đọc email từ {source_name}: {e}")
+                failures.append((source_name, e))
+
+    if failures and len(failures) == len(sources):
+        raise SourceFetchError(failures)
+    if errors is not None:
+        errors.extend(failures)
+    return dedupe_email_results(merged)
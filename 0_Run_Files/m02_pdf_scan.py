@@ -3,11 +3,20 @@ import csv
 import pdfplumber
 import threading
 import concurrent.futures
+import multiprocessing
 import pandas as pd
 import shutil
+import time
+import os
 from pathlib import Path
 from datetime import datetime
-from config import NON_CDS_SUPPLIER_FILE, MAX_WORKERS
+from config import NON_CDS_SUPPLIER_FILE, MAX_WORKERS, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, LARGE_PDF_PAGES, PAGE_CHUNK_SIZE
+from summary_stats import get_counters
+from scheduler import choose_pool_size, estimate_cost, predict_makespan
+from po_store import PdfStore
+from layout_templates import LayoutTemplateStore, compare_with_full_detection, extract_page_tables, layout_key
+from po_archive import lookup_archived, move_cold_rows
+from retry_queue import quarantine_failures, mark_recovered, is_quarantined, load_manifest, pending_entries, wait_for_due
 
 thread_local = threading.local()
 
@@ -44,45 +53,95 @@ def get_buyer_folder_name(buyer_text):
         return "1. TTIVN MFG"
     return "Unknown"
 
+# Precompiled header patterns shared by the legacy extractors and HeaderScanner.
+_PO_RE = re.compile(r"PO#:\s*(\d{6,})", re.IGNORECASE)
+_SELLER_RE = re.compile(r"SELLER:\s*(.*?)\s*BUYER:", re.IGNORECASE | re.DOTALL)
+_VAT_RE = re.compile(r"(\d{1,2})\s*%\s+\d")
+_CURRENCY_RE = re.compile(r"\b(VND|USD|EUR|JPY)\b", re.IGNORECASE)
+_END_USER_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@ttigroup\.com\.vn", re.IGNORECASE)
+
+# Line-level anchors used by HeaderScanner. The *_TAIL patterns match the
+# unfinished prefix of a PO#/VAT match at the end of a line, i.e. the part that
+# the whole-text regex would continue across the line break.
+_SELLER_LABEL_RE = re.compile(r"SELLER:", re.IGNORECASE)
+_BUYER_LABEL_RE = re.compile(r"BUYER:", re.IGNORECASE)
+_PO_TAIL_RE = re.compile(r"PO#:\s*\Z", re.IGNORECASE)
+_VAT_TAIL_RE = re.compile(r"\d{1,2}\s*(?:%\s*)?\Z")
+
 def extract_po_number(text):
-    match = re.search(r"PO#:\s*(\d{6,})", text, re.IGNORECASE)
+    match = _PO_RE.search(text)
     return match.group(1).strip() if match else "Unknown"
 
+def _join_seller_block(seller_block):
+    lines = [line.strip() for line in seller_block.splitlines() if line.strip()]
+    return " ".join(lines)
+
 def extract_seller_name(text):
-    match = re.search(r"SELLER:\s*(.*?)\s*BUYER:", text, re.IGNORECASE | re.DOTALL)
+    match = _SELLER_RE.search(text)
     if match:
-        seller_block = match.group(1).strip()
-        lines = [line.strip() for line in seller_block.splitlines() if line.strip()]
-        return " ".join(lines)
+        return _join_seller_block(match.group(1).strip())
     return "Unknown"
 
-def extract_vat_from_table(text):
-    matches = re.findall(r"(\d{1,2})\s*%\s+\d", text)
-    return "/".join(sorted({m + "%" for m in matches})) if matches else "Unknown"
+def _format_vat(rates):
+    return "/".join(sorted({m + "%" for m in rates})) if rates else "Unknown"
 
-def extract_currency_from_table(text):
-    currencies = re.findall(r"\b(VND|USD|EUR|JPY)\b", text, re.IGNORECASE)
+def _format_currency(currencies):
     valid_currencies = [c.upper() for c in currencies if len(c) == 3]
     return "/".join(sorted(set(valid_currencies))) if valid_currencies else "Unknown"
 
+def extract_vat_from_table(text):
+    return _format_vat(_VAT_RE.findall(text))
+
+def extract_currency_from_table(text):
+    return _format_currency(_CURRENCY_RE.findall(text))
+
+def _uom_from_tables(tables):
+    """UOM result of the first table with a UOM column, or None if there is none."""
+    for table in tables:
+        header = table[0]
+        if not header:
+            continue
+        for i, h in enumerate(header):
+            if h and "uom" in h.lower():
+                col_index = i
+                uoms = set()
+                for row in table[1:]:
+                    if len(row) > col_index:
+                        val = row[col_index]
+                        if val and len(val.strip()) <= 10:
+                            uoms.add(val.strip())
+                return "/".join(sorted(uoms)) if uoms else "Unknown"
+    return None
+
+def _collect_unit_prices(tables, prices):
+    """Append every positive unit price found in ``tables`` to ``prices``."""
+    for table in tables:
+        header = table[0]
+        if not header:
+            continue
+        col_index = None
+        for i, h in enumerate(header):
+            if h and "unit" in h.lower() and "price" in h.lower():
+                col_index = i
+                break
+        if col_index is None:
+            continue
+        for row in table[1:]:
+            try:
+                cell = row[col_index]
+                if cell:
+                    val = float(cell.replace(",", "").replace(" ", ""))
+                    if val > 0:
+                        prices.append(val)
+            except:
+                continue
+
 def extract_uom_from_table(pdf):
     for page in pdf.pages:
         try:
-            tables = page.extract_tables()
-            for table in tables:
-                header = table[0]
-                if not header:
-                    continue
-                for i, h in enumerate(header):
-                    if h and "uom" in h.lower():
-                        col_index = i
-                        uoms = set()
-                        for row in table[1:]:
-                            if len(row) > col_index:
-                                val = row[col_index]
-                                if val and len(val.strip()) <= 10:
-                                    uoms.add(val.strip())
-                        return "/".join(sorted(uoms)) if uoms else "Unknown"
+            uom = _uom_from_tables(page.extract_tables())
+            if uom is not None:
+                return uom
         except:
             continue
     return "Unknown"
@@ -91,35 +150,379 @@ def extract_max_unit_price_from_table(pdf):
     prices = []
     for page in pdf.pages:
         try:
-            tables = page.extract_tables()
-            for table in tables:
-                header = table[0]
-                if not header:
-                    continue
-                col_index = None
-                for i, h in enumerate(header):
-                    if h and "unit" in h.lower() and "price" in h.lower():
-                        col_index = i
-                        break
-                if col_index is None:
-                    continue
-                for row in table[1:]:
-                    try:
-                        cell = row[col_index]
-                        if cell:
-                            val = float(cell.replace(",", "").replace(" ", ""))
-                            if val > 0:
-                                prices.append(val)
-                    except:
-                        continue
+            _collect_unit_prices(page.extract_tables(), prices)
         except:
             continue
     return max(prices) if prices else 0
 
+def _scan_pages(pages, template: dict | None = None, first_index: int = 0, first_page_text: str | None = None) -> dict:
+    """
+    Extract text and the table-based fields from a sequence of pages.
+
+    Each page's tables are extracted once and shared by the UOM and unit price
+    logic. The partial result of a page range is merged by
+    ``_merge_page_scans`` with the same semantics as ``extract_uom_from_table``
+    (first UOM table wins) and ``extract_max_unit_price_from_table`` (maximum
+    over all pages). With a buyer layout ``template`` tables are extracted
+    from the learned region only (see ``layout_templates``); ``first_index``
+    is the position of ``pages[0]`` in the document. ``first_page_text`` is
+    the already extracted text of page 1 of the document, if any.
+    """
+    texts: list[str] = []
+    uom = None
+    prices: list[float] = []
+    learned: list[dict] = []
+    for index, page in enumerate(pages, start=first_index):
+        if index == 0 and first_page_text is not None:
+            texts.append(first_page_text)
+        else:
+            texts.append(page.extract_text() or "")
+        try:
+            tables, learned_layout = extract_page_tables(page, template, index)
+        except:
+            continue
+        if learned_layout:
+            learned.append(learned_layout)
+        if uom is None:
+            try:
+                uom = _uom_from_tables(tables)
+            except:
+                pass
+        try:
+            _collect_unit_prices(tables, prices)
+        except:
+            pass
+    return {"texts": texts, "uom": uom, "max_unit_price": max(prices) if prices else None, "learned": learned}
+
+def _merge_page_scans(parts: list[dict]) -> tuple[str, str, float]:
+    """Merge page-range results (in page order) into ``(text, uom, max_unit_price)``."""
+    texts = [t for part in parts for t in part["texts"]]
+    uom = next((part["uom"] for part in parts if part["uom"] is not None), "Unknown")
+    maxima = [part["max_unit_price"] for part in parts if part["max_unit_price"] is not None]
+    return "\n".join(texts), uom, max(maxima) if maxima else 0
+
+_scan_pool: concurrent.futures.ProcessPoolExecutor | None = None
+_scan_pool_size = 0
+_scan_pool_lock = threading.Lock()
+
+def get_scan_pool() -> tuple[concurrent.futures.ProcessPoolExecutor, int]:
+    """
+    Shared process pool that scans documents and page ranges; returns ``(pool, size)``.
+
+    pdfminer parsing is pure Python and holds the GIL, so a thread pool would
+    run one parse at a time however many threads it had; processes give each
+    worker its own interpreter. The size comes from ``choose_pool_size`` (CPU
+    count, available memory and ``MAX_WORKERS``) when the pool is created.
+    """
+    global _scan_pool, _scan_pool_size
+    with _scan_pool_lock:
+        if _scan_pool is None:
+            _scan_pool_size = choose_pool_size(os.cpu_count() or 1, MAX_WORKERS)
+            # Spawned, not forked: forking a process that runs other threads
+            # (GUI, lease keeper) can copy locks held by them and deadlock
+            _scan_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=_scan_pool_size, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _scan_pool, _scan_pool_size
+
+def shutdown_scan_pool(wait: bool = True) -> None:
+    """
+    Stop the scan pool's worker processes; the next scan starts a new pool.
+
+    Call this before a child process that scanned PDFs exits: its exit joins
+    the idle pool workers, which would otherwise wait for work forever.
+    """
+    global _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is not None:
+            _scan_pool.shutdown(wait=wait, cancel_futures=True)
+        _scan_pool = None
+
+def _warm_worker() -> None:
+    """No-op pool task; running it makes a worker process import this module."""
+
+# Scan workers started by warm_up(); the rest of the pool is spawned on demand
+WARM_WORKERS = 2
+
+def warm_up() -> None:
+    """
+    Pre-load what the first scan would otherwise pay for: the non-CDs supplier
+    list and the first ``WARM_WORKERS`` processes of the scan pool that the
+    first fetch uses (``get_scan_pool``).
+
+    Only a couple of workers are started so an idle GUI does not keep one
+    process per core resident; the pool adds workers when a batch needs them.
+    """
+    load_non_cds_suppliers()
+    pool, size = get_scan_pool()
+    # Spawned workers are started lazily, one per task without an idle worker
+    for future in [pool.submit(_warm_worker) for _ in range(min(WARM_WORKERS, size))]:
+        future.result()
+
+def _scan_document_range(pdf_path: str, start: int, stop: int | None, templates: dict[str, dict]) -> dict:
+    """
+    Process-pool task: scan pages ``[start, stop)`` of one PDF.
+
+    The range starting at page 0 also runs ``triage_pdf``. The buyer is
+    identified from the first line of page 1 and its layout template is taken
+    from ``templates`` (a ``LayoutTemplateStore.snapshot()``); the key and the
+    layouts learned here are returned so the parent can store them.
+
+    Errors are returned rather than raised, as ``{"stage", "error_type",
+    "error"}``, so they reach the parent even when the exception itself
+    cannot be pickled.
+    """
+    stage = "open"
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            # Page 1 text is extracted once for triage, the layout key and the scan
+            stage = "triage" if start == 0 else "scan"
+            first_page_text = (pdf.pages[0].extract_text() or "") if pdf.pages else ""
+            if start == 0:
+                reason = triage_pdf(pdf, pdf_path, first_page_text)
+                if reason:
+                    return {"rejected": reason}
+            stage = "scan"
+            key = None
+            if pdf.pages:
+                first_lines = first_page_text.splitlines()
+                key = layout_key(get_buyer_folder_name(first_lines[0] if first_lines else ""), pdf.pages[0])
+            template = templates.get(key) if key else None
+            part = _scan_pages(pdf.pages[start:stop], template, start, first_page_text)
+        part["key"] = key
+        return part
+    except Exception as e:
+        return {"stage": stage, "error_type": type(e).__name__, "error": str(e)}
+
+def _page_ranges(pages: int | None) -> list[tuple[int, int | None]]:
+    """
+    Split a document into ``PAGE_CHUNK_SIZE`` page ranges when it has at least
+    ``LARGE_PDF_PAGES`` pages (estimated), so one 300-page blanket PO does not
+    keep a single core busy while the others sit idle. The last range is open
+    ended, which covers every page even if the estimate was short.
+    """
+    if not pages or pages < LARGE_PDF_PAGES:
+        return [(0, None)]
+    starts = list(range(0, pages, PAGE_CHUNK_SIZE))
+    return [(start, start + PAGE_CHUNK_SIZE) for start in starts[:-1]] + [(starts[-1], None)]
+
 def extract_end_user_email(text):
-    match = re.search(r"[A-Za-z0-9._%+-]+@ttigroup\.com\.vn", text, re.IGNORECASE)
+    match = _END_USER_EMAIL_RE.search(text)
     return match.group(0).strip() if match else ""
 
+class HeaderScanner:
+    """Extract all PO header fields from the document text in a single pass.
+
+    The legacy ``extract_*`` helpers each run their own regex over the full
+    joined text and ``classify_buyer`` re-splits it to get the first line.
+    ``HeaderScanner`` walks the text once, line by line, using the precompiled
+    patterns above and anchoring on the ``PO#:``, ``SELLER:`` and ``BUYER:``
+    labels. Matches that the whole-text regexes would continue across a line
+    break (e.g. ``PO#:`` followed by the number on the next line, or a VAT rate
+    at the end of a row) are carried over to the next line so the results are
+    identical to the legacy functions.
+
+    Example:
+    >>> fields = HeaderScanner().scan(text)
+    >>> fields["po_number"], fields["buyer"]
+    """
+
+    FIELDS = ("po_number", "buyer", "seller", "vat", "currency", "end_user_email")
+
+    def scan(self, text: str) -> dict[str, str]:
+        """Return a dict with one entry per name in ``FIELDS``."""
+        lines = text.split("\n") if text else []
+
+        # classify_buyer() historically received text.splitlines()[0]
+        first_line = ""
+        if lines:
+            first_parts = lines[0].splitlines()
+            first_line = first_parts[0] if first_parts else ""
+
+        po_number: str | None = None
+        po_carry: str | None = None
+        seller_parts: list[str] | None = None
+        seller: str | None = None
+        vat_rates: list[str] = []
+        vat_carry: str | None = None
+        currencies: list[str] = []
+        end_user_email: str | None = None
+
+        for line in lines:
+            # PO#: first match, possibly continued from the previous line
+            if po_number is None:
+                buffer = line if po_carry is None else po_carry + "\n" + line
+                match = _PO_RE.search(buffer)
+                if match:
+                    po_number = match.group(1).strip()
+                    po_carry = None
+                else:
+                    tail = _PO_TAIL_RE.search(buffer)
+                    po_carry = buffer[tail.start():] if tail else None
+
+            # SELLER: ... BUYER: block
+            if seller is None:
+                if seller_parts is None:
+                    label = _SELLER_LABEL_RE.search(line)
+                    if label:
+                        rest = line[label.end():]
+                        buyer_label = _BUYER_LABEL_RE.search(rest)
+                        if buyer_label:
+                            seller = _join_seller_block(rest[:buyer_label.start()].strip())
+                        else:
+                            seller_parts = [rest]
+                else:
+                    buyer_label = _BUYER_LABEL_RE.search(line)
+                    if buyer_label:
+                        seller_parts.append(line[:buyer_label.start()])
+                        seller = _join_seller_block("\n".join(seller_parts).strip())
+                    else:
+                        seller_parts.append(line)
+
+            # VAT rates: all non-overlapping matches, with cross-line carry
+            buffer = line if vat_carry is None else vat_carry + "\n" + line
+            last_end = 0
+            for match in _VAT_RE.finditer(buffer):
+                vat_rates.append(match.group(1))
+                last_end = match.end()
+            tail = _VAT_TAIL_RE.search(buffer, last_end)
+            vat_carry = buffer[tail.start():] if tail else None
+
+            currencies.extend(_CURRENCY_RE.findall(line))
+
+            if end_user_email is None:
+                match = _END_USER_EMAIL_RE.search(line)
+                if match:
+                    end_user_email = match.group(0).strip()
+
+        return {
+            "po_number": po_number or "Unknown",
+            "buyer": classify_buyer(first_line),
+            "seller": seller if seller is not None else "Unknown",
+            "vat": _format_vat(vat_rates),
+            "currency": _format_currency(currencies),
+            "end_user_email": end_user_email or "",
+        }
+
+def scan_header_fields(text: str) -> dict[str, str]:
+    """Convenience wrapper around ``HeaderScanner().scan``."""
+    return HeaderScanner().scan(text)
+
+def compare_layout_templates(pdf_path, output_base_dir: Path) -> dict[int, tuple[list, list]]:
+    """Compare the learned layout template with full table detection on one PO.
+
+    Intended for checking the templates in ``log/layout_templates.json``
+    against a golden corpus of PO PDFs. Returns ``{page_index: (full_rows,
+    template_rows)}`` for every page where the line-item rows differ; an
+    empty dict means the outputs are identical (or no template applies).
+    """
+    templates = LayoutTemplateStore(output_base_dir)
+    with pdfplumber.open(pdf_path) as pdf:
+        if not pdf.pages:
+            return {}
+        first_lines = (pdf.pages[0].extract_text() or "").splitlines()
+        template = templates.get(layout_key(get_buyer_folder_name(first_lines[0] if first_lines else ""), pdf.pages[0]))
+        if not template:
+            return {}
+        differences = {}
+        for index, page in enumerate(pdf.pages):
+            difference = compare_with_full_detection(page, template, index)
+            if difference:
+                differences[index] = difference
+        return differences
+
+def compare_header_scan(text: str) -> dict[str, tuple[str, str]]:
+    """Compare ``HeaderScanner`` with the legacy extractors on one document.
+
+    Intended for checking the scanner against a golden corpus of PO texts.
+    Returns ``{field: (legacy_value, scanner_value)}`` for every field that
+    differs; an empty dict means the outputs are identical.
+    """
+    legacy = {
+        "po_number": extract_po_number(text),
+        "buyer": classify_buyer(text.splitlines()[0] if text else ""),
+        "seller": extract_seller_name(text),
+        "vat": extract_vat_from_table(text),
+        "currency": extract_currency_from_table(text),
+        "end_user_email": extract_end_user_email(text),
+    }
+    scanned = scan_header_fields(text)
+    return {k: (legacy[k], scanned[k]) for k in HeaderScanner.FIELDS if legacy[k] != scanned[k]}
+
+# Attachment names / PDF metadata that identify documents other than POs.
+# Whole words only ("_" and digits count as separators): "Drawer" is not a drawing.
+_NON_PO_NAME_RE = re.compile(
+    r"(?<![a-z])(quotes?|quotations?|invoices?|inv|drawings?|dwgs?|catalog(ue)?s?|brochures?|datasheets?|packing[\s_-]*lists?)(?![a-z])",
+    re.IGNORECASE,
+)
+_PO_NAME_RE = re.compile(r"\bPO[\s_#-]*\d{6,}|purchase[\s_-]*order", re.IGNORECASE)
+# A PO number may be all a PO attachment is named after ("4500123456_quote_rev.pdf")
+_PO_NUMBER_LIKE_RE = re.compile(r"\d{6,}")
+_PO_MARKER_RE = re.compile(r"PO#:|SELLER:|BUYER:", re.IGNORECASE)
+
+def triage_pdf_name(pdf_path) -> str | None:
+    """
+    Reject by attachment name only; returns the rejection reason or None.
+
+    Names containing a number of 6 or more digits are never rejected here;
+    their content decides (see ``triage_pdf``).
+    """
+    name = Path(pdf_path).stem
+    if _PO_NUMBER_LIKE_RE.search(name):
+        return None
+    if _NON_PO_NAME_RE.search(name) and not _PO_NAME_RE.search(name):
+        return "filename"
+    return None
+
+def triage_pdf(pdf, pdf_path, first_page_text: str | None = None) -> str | None:
+    """
+    Cheap check whether an opened PDF is a PO before full parsing.
+
+    Looks at the file name, the PDF metadata (Title/Subject/Keywords) and the
+    text of the first page only, which must contain at least one of the
+    ``PO#:``, ``SELLER:`` or ``BUYER:`` markers. Returns the rejection reason
+    (``"filename"``, ``"metadata"``, ``"no_po_marker"``) or None for a PO.
+    ``first_page_text`` avoids extracting page 1 again when the caller has it.
+    """
+    reason = triage_pdf_name(pdf_path)
+    if reason:
+        return reason
+    metadata = pdf.metadata or {}
+    meta_text = " ".join(str(metadata.get(key, "")) for key in ("Title", "Subject", "Keywords"))
+    if _NON_PO_NAME_RE.search(meta_text) and not _PO_NAME_RE.search(meta_text):
+        return "metadata"
+    if not pdf.pages:
+        return "no_po_marker"
+    if first_page_text is None:
+        first_page_text = pdf.pages[0].extract_text() or ""
+    if not _PO_MARKER_RE.search(first_page_text):
+        return "no_po_marker"
+    return None
+
+def load_non_cds_suppliers() -> set[str]:
+    """Return the non-CDs supplier list, reading the CSV only on first use."""
+    # Cache the non-CDs supplier list to avoid re-reading the CSV on every call.
+    # The list is stored on the module object so it persists across calls.
+    global _NON_CDS_SUPPLIER_CACHE
+    try:
+        cache = _NON_CDS_SUPPLIER_CACHE
+    except NameError:
+        cache = None
+
+    if cache is None:
+        non_cds_sellers: set[str] = set()
+        supplier_path = Path(NON_CDS_SUPPLIER_FILE)
+        if supplier_path.exists():
+            try:
+                df_sup = pd.read_csv(supplier_path, dtype=str)
+                non_cds_sellers = set(df_sup.iloc[:, 0].str.upper().str.strip())
+            except Exception:
+                # If reading fails, leave the set empty and continue
+                pass
+        _NON_CDS_SUPPLIER_CACHE = non_cds_sellers
+        return non_cds_sellers
+    return cache
+
 def determine_need_cds(vat: str, currency: str, uom: str, seller: str, max_unit_price: float) -> str:
     """Determine whether a PO requires a customs declaration sheet (CDs).
 
@@ -152,27 +555,7 @@ def determine_need_cds(vat: str, currency: str, uom: str, seller: str, max_unit_
     str
         ``"Yes"`` if CDs are required, otherwise ``"No"``.
     """
-    # Cache the non-CDs supplier list to avoid re-reading the CSV on every call.
-    # The list is stored on the module object so it persists across calls.
-    global _NON_CDS_SUPPLIER_CACHE
-    try:
-        cache = _NON_CDS_SUPPLIER_CACHE
-    except NameError:
-        cache = None
-
-    if cache is None:
-        non_cds_sellers: set[str] = set()
-        supplier_path = Path(NON_CDS_SUPPLIER_FILE)
-        if supplier_path.exists():
-            try:
-                df_sup = pd.read_csv(supplier_path, dtype=str)
-                non_cds_sellers = set(df_sup.iloc[:, 0].str.upper().str.strip())
-            except Exception:
-                # If reading fails, leave the set empty and continue
-                pass
-        _NON_CDS_SUPPLIER_CACHE = non_cds_sellers
-    else:
-        non_cds_sellers = cache
+    non_cds_sellers = load_non_cds_suppliers()
 
     seller_clean = (seller or "").upper().strip()
     vat_clean = (vat or "").strip()
@@ -212,14 +595,28 @@ def determine_need_cds(vat: str, currency: str, uom: str, seller: str, max_unit_
     # Default to requiring CDs
     return "Yes"
 
-def process_po_pdfs(email_results: list[dict], output_base_dir: Path):
+LOG_COLUMNS = [
+    "PO Number", "Buyer", "Seller", "VAT", "Currency", "UOM",
+    "Max Unit Price", "Need_CDs", "Supplier/Vendor email", "End-User Email", "ReceivedTime"
+]
+
+def process_po_pdfs(email_results: list[dict], output_base_dir: Path) -> dict:
     """
     Scan downloaded PO PDFs, classify whether CDs are needed and update the log.
 
-    This implementation uses a thread pool to parallelize PDF parsing. Results
+    This implementation uses a process pool to parallelize PDF parsing
+    (``get_scan_pool``). PDFs are dispatched largest-first and the pool is
+    sized from CPU count and memory (see ``scheduler``); the predicted and
+    actual batch times are appended to ``log/scheduler.csv``. Very large PDFs
+    are split into page ranges scanned by several workers. Results
     are collected in memory and written to disk once at the end, reducing
     contention and I/O overhead (improvement items 1–3). Any errors
-    encountered while processing a PDF are recorded in ``log/error.txt``.
+    encountered while processing a PDF are recorded in ``log/error.txt`` and
+    the PDF is moved to the quarantine folder with an entry in the retry
+    manifest (see ``retry_queue``), so ``retry_failed_pdfs`` can reprocess
+    only the failures. Non-PO attachments (quotations, invoices, drawings,
+    catalogs...) are rejected by ``triage_pdf`` before full parsing; they are
+    moved to ``rejected/`` and listed in ``log/rejected.csv`` for review.
 
     Parameters
     ----------
@@ -227,6 +624,191 @@ def process_po_pdfs(email_results: list[dict], output_base_dir: Path):
         A list of dictionaries returned by ``read_po_emails_and_save_pdfs``.
     output_base_dir : Path
         The base directory where ``log`` and ``PO_Filtered`` folders reside.
+
+    Returns
+    -------
+    dict
+        Run statistics: ``scanned`` (POs written to the log), ``failed`` and
+        ``rejected`` (``{reason: count}`` of non-PO documents skipped by triage).
+    """
+    LOG_DIR = output_base_dir / "log"
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+
+    scan = scan_po_batch(email_results, output_base_dir)
+    file_scan_results(scan, output_base_dir)
+
+    # Remove temporary files after processing
+    temp_folder = output_base_dir / "temp"
+    if temp_folder.exists():
+        try:
+            shutil.rmtree(temp_folder)
+        except Exception as e:
+            print(f"⚠️ Không thể xóa thư mục tạm: {e}")
+
+    rejected = scan["rejected"]
+    if rejected:
+        print(f"🚫 Bỏ qua {sum(rejected.values())} PDF không phải PO: {rejected}")
+    return {"scanned": len(scan["results"]), "failed": len(scan["failures"]), "rejected": rejected}
+
+def scan_po_batch(email_results: list[dict], output_base_dir: Path) -> dict:
+    """
+    Triage and scan a batch of PDFs without touching the PO log or folders.
+
+    This is the parsing half of ``process_po_pdfs`` and is also run by the
+    worker nodes of the distributed mode (see ``work_queue``). Only
+    ``log/error.txt``, ``log/scheduler.csv`` and the layout templates under
+    ``output_base_dir`` are written.
+
+    Returns
+    -------
+    dict
+        ``results`` (one dict per scanned PO), ``failures`` (as expected by
+        ``quarantine_failures``), ``rejected`` (``{reason: count}``),
+        ``rejected_files`` (``(pdf_path, reason)`` pairs) and ``recovered``
+        (quarantined paths that need no further retry).
+    """
+    log_dir = output_base_dir / "log"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    error_log_path = log_dir / "error.txt"
+
+    # Learned per-buyer table layouts (see layout_templates.py)
+    templates = LayoutTemplateStore(output_base_dir)
+
+    results: list[dict] = []
+    failures: list[dict] = []
+    rejected: dict[str, int] = {}
+    rejected_files: list[tuple[Path, str]] = []
+    recovered: list[Path] = []
+
+    def fail(res: dict, pdf_path: Path, stage: str, error, error_type: str | None = None) -> None:
+        # Capture any error and log it for troubleshooting (improvement 11)
+        with error_log_path.open("a", encoding="utf-8") as err_file:
+            err_file.write(f"{pdf_path}: {error}\n")
+        failures.append(_failure_entry(res, pdf_path, stage, error, error_type))
+
+    def finish_one(res: dict, parts: list[dict]) -> None:
+        pdf_path = Path(res.get("pdf_path"))
+        failed = next((part for part in parts if "error_type" in part), None)
+        if failed:
+            fail(res, pdf_path, failed["stage"], failed["error"], failed["error_type"])
+            return
+        if "rejected" in parts[0]:
+            reject(pdf_path, parts[0]["rejected"])
+            return
+        for part in parts:
+            for learned in part["learned"]:
+                templates.learn(part["key"], learned)
+        try:
+            text, uom, max_unit_price = _merge_page_scans(parts)
+            # Single pass over the text for all header fields
+            fields = scan_header_fields(text)
+            need_cds = determine_need_cds(fields["vat"], fields["currency"], uom, fields["seller"], max_unit_price)
+        except Exception as e:
+            fail(res, pdf_path, "scan", e)
+            return
+        results.append({
+            "po_number": fields["po_number"],
+            "buyer": fields["buyer"],
+            "seller": fields["seller"],
+            "vat": fields["vat"],
+            "currency": fields["currency"],
+            "uom": uom,
+            "max_unit_price": max_unit_price,
+            "need_cds": need_cds,
+            "to_emails": res.get("to_emails", ""),
+            "received_time": res.get("received_time", ""),
+            "end_user_email": fields["end_user_email"],
+            "subject": res.get("subject", ""),
+            "pdf_path": pdf_path,
+            # Buyer folder under PO_Filtered if the PO needs CDs
+            "filtered_folder": get_buyer_folder_name(fields["buyer"]) if need_cds == "Yes" else None,
+        })
+
+    def reject(pdf_path: Path, reason: str) -> None:
+        rejected[reason] = rejected.get(reason, 0) + 1
+        rejected_files.append((pdf_path, reason))
+        # A quarantined file that turns out not to be a PO needs no retry
+        if is_quarantined(pdf_path, output_base_dir):
+            recovered.append(pdf_path)
+
+    # Filename triage needs no I/O, so rejected names are not even scheduled
+    candidates = []
+    for res in email_results:
+        reason = triage_pdf_name(res.get("pdf_path", ""))
+        if reason:
+            reject(Path(res.get("pdf_path")), reason)
+        elif Path(res.get("pdf_path", "")).exists():
+            candidates.append(res)
+
+    # Documents (and page ranges of large ones) go to the process pool largest first (LPT)
+    tasks = []
+    for doc, cost in enumerate(estimate_cost(res) for res in candidates):
+        ranges = _page_ranges(cost.pages)
+        for start, stop in ranges:
+            tasks.append((cost.cost / len(ranges), doc, start, stop))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    pool, pool_size = get_scan_pool()
+    workers = min(pool_size, len(tasks)) or 1
+    predicted = predict_makespan([task[0] for task in tasks], workers)
+    snapshot = templates.snapshot()
+
+    started = time.perf_counter()
+    parts: dict[int, dict[int, dict]] = {doc: {} for doc in range(len(candidates))}
+    remaining = {doc: 0 for doc in range(len(candidates))}
+    futures = {}
+    for _, doc, start, stop in tasks:
+        remaining[doc] += 1
+        future = pool.submit(_scan_document_range, str(candidates[doc]["pdf_path"]), start, stop, snapshot)
+        futures[future] = (doc, start)
+    broken = None
+    for future in concurrent.futures.as_completed(futures):
+        doc, start = futures[future]
+        try:
+            parts[doc][start] = future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # A crashed worker breaks the pool for every pending task; they are
+            # quarantined and the pool is recreated for the next batch
+            broken = e
+            parts[doc][start] = {"stage": "scan", "error_type": type(e).__name__, "error": str(e) or "worker process died"}
+        remaining[doc] -= 1
+        if remaining[doc] == 0:
+            finish_one(candidates[doc], [parts[doc][key] for key in sorted(parts[doc])])
+    if broken is not None:
+        shutdown_scan_pool(wait=False)
+    actual = time.perf_counter() - started
+    log_makespan(log_dir, len(candidates), workers, predicted, actual)
+    templates.save()
+
+    return {
+        "results": results,
+        "failures": failures,
+        "rejected": rejected,
+        "rejected_files": rejected_files,
+        "recovered": recovered,
+    }
+
+def _failure_entry(res: dict, pdf_path: Path, stage: str, error, error_type: str | None = None) -> dict:
+    return {
+        "pdf_path": pdf_path,
+        "stage": stage,
+        "error": error,
+        "error_type": error_type,
+        "to_emails": res.get("to_emails", ""),
+        "received_time": res.get("received_time", ""),
+        "subject": res.get("subject", ""),
+    }
+
+def file_scan_results(scan: dict, output_base_dir: Path) -> None:
+    """
+    Write scanned POs to this thread's log and file their PDFs.
+
+    This is the second half of ``process_po_pdfs``: rows go to
+    ``log/thread_<ident>.csv`` (merged later by ``merge_thread_logs``), PDFs
+    that need CDs are filed under ``PO_Filtered/<buyer>`` through the
+    content-addressed store, failures are quarantined and recovered entries
+    are dropped from the retry manifest and PDFs rejected by triage are moved
+    to ``rejected/`` (see ``set_aside_rejected``). ``scan`` is the dict returned by
+    ``scan_po_batch``; its ``failures`` list is extended with filing errors.
     """
     LOG_DIR = output_base_dir / "log"
     FILTERED_DIR = output_base_dir / "PO_Filtered"
@@ -237,81 +819,19 @@ def process_po_pdfs(email_results: list[dict], output_base_dir: Path):
     log_path = LOG_DIR / f"thread_{thread_id}.csv"
     error_log_path = LOG_DIR / "error.txt"
 
-    COLUMNS = [
-        "PO Number", "Buyer", "Seller", "VAT", "Currency", "UOM",
-        "Max Unit Price", "Need_CDs", "Supplier/Vendor email", "End-User Email", "ReceivedTime"
-    ]
-    df_log = pd.read_csv(log_path, dtype=str) if log_path.exists() else pd.DataFrame(columns=COLUMNS)
+    df_log = pd.read_csv(log_path, dtype=str) if log_path.exists() else pd.DataFrame(columns=LOG_COLUMNS)
+
+    # Content-addressed store behind the PO_Filtered folders (see po_store.py)
+    pdf_store = PdfStore(output_base_dir)
 
     # Preload existing PO numbers to detect revisions
     existing_po_numbers = set(df_log["PO Number"].values)
 
-    results: list[dict] = []
-
-    def process_one(res: dict) -> dict | None:
-        pdf_path = Path(res.get("pdf_path"))
-        if not pdf_path.exists():
-            return None
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                # Extract text once for reuse
-                text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-                # Use extracted text for all functions that operate on strings
-                uom = extract_uom_from_table(pdf)
-                max_unit_price = extract_max_unit_price_from_table(pdf)
-                end_user_email = extract_end_user_email(text)
-
-            po_number = extract_po_number(text)
-            buyer = classify_buyer(text.splitlines()[0] if text else "")
-            seller = extract_seller_name(text)
-            vat = extract_vat_from_table(text)
-            currency = extract_currency_from_table(text)
-            need_cds = determine_need_cds(vat, currency, uom, seller, max_unit_price)
-
-            # Prepare rename destination if needed
-            rename_dest: Path | None = None
-            if need_cds == "Yes":
-                folder_name = get_buyer_folder_name(buyer)
-                dest = FILTERED_DIR / folder_name
-                dest.mkdir(parents=True, exist_ok=True)
-                new_path = dest / pdf_path.name
-                if new_path.exists():
-                    new_path = new_path.with_name(
-                        f"{new_path.stem}_{datetime.now():%Y%m%d%H%M%S}{new_path.suffix}"
-                    )
-                rename_dest = new_path
-
-            return {
-                "po_number": po_number,
-                "buyer": buyer,
-                "seller": seller,
-                "vat": vat,
-                "currency": currency,
-                "uom": uom,
-                "max_unit_price": max_unit_price,
-                "need_cds": need_cds,
-                "to_emails": res.get("to_emails", ""),
-                "received_time": res.get("received_time", ""),
-                "end_user_email": end_user_email,
-                "pdf_path": pdf_path,
-                "rename_dest": rename_dest,
-            }
-        except Exception as e:
-            # Capture any error and log it for troubleshooting (improvement 11)
-            with error_log_path.open("a", encoding="utf-8") as err_file:
-                err_file.write(f"{pdf_path}: {e}\n")
-            return None
-
-    # Parallel processing of PDFs
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_result = {executor.submit(process_one, res): res for res in email_results}
-        for future in concurrent.futures.as_completed(future_to_result):
-            processed = future.result()
-            if processed:
-                results.append(processed)
+    failures = scan["failures"]
+    recovered = list(scan["recovered"])
 
     # Update log based on processed results
-    for item in results:
+    for item in scan["results"]:
         po_number = item["po_number"] or "Unknown"
         need_cds = item["need_cds"]
         # Remove existing entry if PO number already exists
@@ -348,26 +868,104 @@ def process_po_pdfs(email_results: list[dict], output_base_dir: Path):
             copy=False
         )
 
-        # Rename the PDF if necessary
-        dest = item.get("rename_dest")
-        if dest:
+        # File the PDF under PO_Filtered/<buyer> (stored once by content)
+        folder_name = item.get("filtered_folder")
+        renamed = True
+        if folder_name:
             try:
-                item["pdf_path"].rename(dest)
+                pdf_store.add(item["pdf_path"], folder_name, clean_cell(po_number))
             except Exception as e:
                 # Log rename errors but continue
                 with error_log_path.open("a", encoding="utf-8") as err_file:
                     err_file.write(f"Rename error for {item['pdf_path']}: {e}\n")
+                failures.append(_failure_entry(item, item["pdf_path"], "rename", e))
+                renamed = False
+        if renamed and is_quarantined(item["pdf_path"], output_base_dir):
+            recovered.append(item["pdf_path"])
 
     # Persist log to CSV once
     df_log.to_csv(log_path, index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
 
-    # Remove temporary files after processing
-    temp_folder = output_base_dir / "temp"
-    if temp_folder.exists():
-        try:
-            shutil.rmtree(temp_folder)
-        except Exception as e:
-            print(f"⚠️ Không thể xóa thư mục tạm: {e}")
+    # Keep failed and rejected PDFs out of temp/ before it is removed
+    quarantine_failures(output_base_dir, failures)
+    set_aside_rejected(output_base_dir, scan["rejected_files"])
+    mark_recovered(output_base_dir, recovered)
+
+def set_aside_rejected(output_base_dir: Path, rejected_files: list[tuple[Path, str]]) -> None:
+    """
+    Move PDFs rejected by triage to ``rejected/`` and log them with their reason.
+
+    Rejection is heuristic, so the files are kept for review instead of being
+    deleted with ``temp/``; ``log/rejected.csv`` lists the time, original file
+    name, reason and where the file was moved.
+    """
+    if not rejected_files:
+        return
+    rejected_dir = output_base_dir / "rejected"
+    rejected_dir.mkdir(parents=True, exist_ok=True)
+    log_path = output_base_dir / "log" / "rejected.csv"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    is_new = not log_path.exists()
+    with log_path.open("a", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+        if is_new:
+            writer.writerow(["Timestamp", "File", "Reason", "Moved To"])
+        for pdf_path, reason in rejected_files:
+            src = Path(pdf_path)
+            if not src.exists():
+                continue
+            dest = rejected_dir / src.name
+            count = 1
+            while dest.exists():
+                dest = rejected_dir / f"{src.stem}_{count}{src.suffix}"
+                count += 1
+            try:
+                shutil.move(str(src), str(dest))
+            except Exception as e:
+                print(f"⚠️ Không thể chuyển file vào rejected: {src} - {e}")
+                dest = ""
+            writer.writerow([f"{datetime.now():%Y-%m-%d %H:%M:%S}", src.name, reason, str(dest)])
+
+def log_makespan(log_dir: Path, documents: int, workers: int, predicted: float, actual: float) -> None:
+    """Append the predicted vs actual scan time of a batch to ``scheduler.csv``."""
+    path = log_dir / "scheduler.csv"
+    is_new = not path.exists()
+    with path.open("a", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+        if is_new:
+            writer.writerow(["Timestamp", "Documents", "Workers", "Predicted (s)", "Actual (s)"])
+        writer.writerow([f"{datetime.now():%Y-%m-%d %H:%M:%S}", documents, workers, round(predicted, 2), round(actual, 2)])
+    print(f"⏱️ Scan {documents} PDF với {workers} worker: dự kiến {predicted:.1f}s, thực tế {actual:.1f}s")
+
+def retry_failed_pdfs(output_base_dir: Path, max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY) -> int:
+    """
+    Reprocess only the quarantined PDFs listed in the retry manifest.
+
+    Entries are retried with exponential backoff: an entry that has failed
+    ``n`` times becomes due ``base_delay * 2 ** (n - 1)`` seconds after its
+    last attempt. The function keeps running rounds of due entries through
+    ``process_po_pdfs`` until every entry has either succeeded or used up
+    ``max_attempts``. Call ``merge_thread_logs`` afterwards as for a normal run.
+
+    Returns
+    -------
+    int
+        Number of PDFs still failing after the retries.
+    """
+    output_base_dir = Path(output_base_dir)
+    while True:
+        pending = pending_entries(output_base_dir, max_attempts)
+        # Files removed from quarantine by hand can never succeed; forget them
+        missing = [e["pdf_path"] for e in pending if not Path(e["pdf_path"]).exists()]
+        if missing:
+            mark_recovered(output_base_dir, missing)
+            continue
+        if not pending:
+            break
+        due = wait_for_due(pending, base_delay)
+        if due:
+            process_po_pdfs(due, output_base_dir)
+    return len(load_manifest(output_base_dir))
 
 def merge_thread_logs(output_base_dir):
     log_dir = Path(output_base_dir) / "log"
@@ -376,6 +974,8 @@ def merge_thread_logs(output_base_dir):
 
     final_path = log_dir / "po_log.csv"
     df_final = pd.DataFrame()
+    # Load (or bootstrap) the summary counters before the log changes
+    counters = get_counters(output_base_dir)
 
     # Đọc log cũ nếu có (read existing final log if any)
     if final_path.exists():
@@ -387,10 +987,28 @@ def merge_thread_logs(output_base_dir):
         df_threads = pd.concat(df_list, ignore_index=True, sort=False, copy=False)
         df_all = pd.concat([df_final, df_threads], ignore_index=True)
         df_all.drop_duplicates(subset="PO Number", keep="last", inplace=True)
+
+        # Update the materialized summary with only the rows that changed
+        df_new = df_threads.drop_duplicates(subset="PO Number", keep="last")
+        replaced = (
+            df_final[df_final["PO Number"].isin(df_new["PO Number"])]
+            if not df_final.empty else df_final
+        )
+        # POs re-scanned after their previous row was archived
+        in_hot = df_new["PO Number"].isin(df_final["PO Number"] if not df_final.empty else [])
+        archived = lookup_archived(output_base_dir, df_new.loc[~in_hot, "PO Number"])
+        counters.record_rows(
+            df_new.to_dict("records"),
+            replaced.to_dict("records") + archived.to_dict("records"),
+        )
     else:
         df_all = df_final
 
+    # Keep only the hot working set in po_log.csv (see po_archive.py)
+    df_all = move_cold_rows(output_base_dir, df_all)
+
     df_all.to_csv(final_path, index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
+    counters.save()
 
     for f in log_files:
         f.unlink(missing_ok=True)
@@ -4,7 +4,8 @@ import pandas as pd
 import win32com.client  # type: ignore[import]
 from jinja2 import Template
 
-from config import TEMPLATE_LOCAL, TEMPLATE_OVERSEA, TEMP_DIR
+from config import TEMPLATE_LOCAL, TEMPLATE_OVERSEA, TEMP_DIR, ENTITY_SHORT_NAMES, EMAIL_MAX_ATTACHMENT_MB
+from summary_stats import get_counters
 
 # --- Email body template ---
 EMAIL_BODY_TEMPLATE = Template(
@@ -25,9 +26,36 @@ TTIVN Customs Team
     """
 )
 
+# --- Batched email body: one email listing every PO of a supplier/entity ---
+BATCH_EMAIL_BODY_TEMPLATE = Template(
+    """
+Dear Supplier,
+
+This is an automatic request from our system regarding the following {{ pos|length }} PO(s):
+
+{% for po in pos %}  - PO# {{ po["PO Number"] }} ({{ po["Currency"] }})
+{% endfor %}
+To support customs declaration procedures, please kindly fill in the attached “Cargo Info” file of each PO (the file name contains the PO number) with full and correct product details once the goods are ready and the shipment is being prepared.
+
+If a PO does not involve any item requiring customs clearance, you may kindly ignore it.
+
+Thank you for your cooperation.
+
+Best regards,
+
+TTIVN Customs Team
+    """
+)
+
 def is_valid_email(email):
     return isinstance(email, str) and re.match(r"[^@]+@[^@]+\.[^@]+", email.strip())
 
+def split_emails(raw):
+    """Valid addresses from a ``;`` or ``/`` separated field, in order."""
+    if not isinstance(raw, str):
+        return []
+    return [e.strip() for e in re.split(r"[;/]", raw) if is_valid_email(e)]
+
 def load_log(output_base_dir):
     log_file = Path(output_base_dir) / "log" / "po_log.csv"
     if not log_file.exists():
@@ -44,6 +72,21 @@ def filter_po_need_email(df):
         (df["Supplier/Vendor email"].notna())
     ]
 
+def filter_by_entity(df, entity):
+    """Keep rows whose Buyer maps to the short entity name (``"ALL"`` keeps all)."""
+    if not entity or entity.strip().upper() == "ALL":
+        return df
+    short_names = df["Buyer"].map(ENTITY_SHORT_NAMES).fillna("").str.upper()
+    return df[short_names == entity.strip().upper()]
+
+def record_emails_sent(output_base_dir, sent_rows):
+    """Update the materialized summary counters after request emails were sent."""
+    if not sent_rows:
+        return
+    counters = get_counters(output_base_dir)
+    counters.record_emails_sent(sent_rows)
+    counters.save()
+
 def get_attachments(po_number, currency, output_base_dir):
     attachments = []
     template_file = None
@@ -78,14 +121,14 @@ def send_email_outlook(po_row, output_base_dir):
     po_number = po_row["PO Number"]
 
     raw_to = po_row["Supplier/Vendor email"]
-    to_emails = [e.strip() for e in re.split(r"[;/]", raw_to) if is_valid_email(e)]
+    to_emails = split_emails(raw_to)
     if not to_emails:
         print(f"❌ Không có email hợp lệ trong TO cho PO {po_number}: {raw_to}")
         return False
     mail.To = "; ".join(to_emails)
 
     raw_cc = po_row.get("End-User Email", "")
-    cc_emails = [e.strip() for e in re.split(r"[;/]", raw_cc) if is_valid_email(e)]
+    cc_emails = split_emails(raw_cc)
     mail.CC = "; ".join(cc_emails)
 
     mail.Subject = f"{po_row['Buyer']}/PO#{po_number}/Cargo info Request"
@@ -114,6 +157,52 @@ def send_email_outlook(po_row, output_base_dir):
             return False
 
     # Clean up temp files
+    _cleanup_temp_attachments(attachments)
+
+    return True
+
+def group_by_supplier(df):
+    """
+    Group pending rows by supplier address set and Buyer entity.
+
+    Returns a list of ``(to_emails, buyer, rows)`` where ``rows`` is the
+    sub-DataFrame in log order. Rows without a valid TO address are left out
+    (``send_email_outlook`` would refuse them as well).
+    """
+    groups = {}
+    for idx, row in df.iterrows():
+        to_emails = split_emails(row["Supplier/Vendor email"])
+        if not to_emails:
+            print(f"❌ Không có email hợp lệ trong TO cho PO {row['PO Number']}: {row['Supplier/Vendor email']}")
+            continue
+        addresses = {}
+        for e in to_emails:
+            addresses.setdefault(e.lower(), e)
+        key = (tuple(sorted(addresses)), row["Buyer"])
+        if key not in groups:
+            groups[key] = (list(addresses.values()), [])
+        groups[key][1].append(idx)
+    return [(to_emails, buyer, df.loc[index]) for (_, buyer), (to_emails, index) in groups.items()]
+
+def split_by_attachment_size(items, max_bytes):
+    """
+    Split ``(po_row, attachments)`` items into consecutive chunks whose
+    attachments total at most ``max_bytes``. A PO whose own attachments exceed
+    the cap is sent alone.
+    """
+    chunks, current, current_size = [], [], 0
+    for po_row, attachments in items:
+        size = sum(f.stat().st_size for f in attachments if f.exists())
+        if current and current_size + size > max_bytes:
+            chunks.append(current)
+            current, current_size = [], 0
+        current.append((po_row, attachments))
+        current_size += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _cleanup_temp_attachments(attachments):
     for file in attachments:
         try:
             if file.exists() and file.parent.resolve() == Path(TEMP_DIR).resolve():
@@ -121,9 +210,77 @@ def send_email_outlook(po_row, output_base_dir):
         except Exception as e:
             print(f"⚠\ufe0f Không thể xoá file tạm: {file} - {e}")
 
+def send_batch_email_outlook(to_emails, buyer, items, outlook=None):
+    """
+    Send one email for several POs of the same supplier and entity.
+
+    ``items`` is a list of ``(po_row, attachments)`` as built by
+    ``get_attachments``. Returns True if ``mail.Send()`` succeeded.
+    """
+    outlook = outlook or win32com.client.Dispatch("Outlook.Application")
+    mail = outlook.CreateItem(0)
+    po_rows = [po_row for po_row, _ in items]
+    po_numbers = [str(po_row["PO Number"]) for po_row in po_rows]
+
+    mail.To = "; ".join(to_emails)
+    cc_emails = []
+    for po_row in po_rows:
+        cc_emails.extend(e for e in split_emails(po_row.get("End-User Email", "")) if e not in cc_emails)
+    mail.CC = "; ".join(cc_emails)
+
+    shown = ", ".join(po_numbers[:5]) + (f" +{len(po_numbers) - 5}" if len(po_numbers) > 5 else "")
+    mail.Subject = f"{buyer}/PO#{shown}/Cargo info Request"
+    mail.Body = BATCH_EMAIL_BODY_TEMPLATE.render(pos=po_rows).strip()
+
+    for _, attachments in items:
+        for file in attachments:
+            try:
+                if file.exists():
+                    mail.Attachments.Add(str(file))
+            except Exception as e:
+                print(f"⚠\ufe0f Không thể đính kèm file: {file} - {e}")
+
+    try:
+        mail.Send()
+        print(f"✅ Đã gửi email gộp cho PO {', '.join(po_numbers)}")
+    except Exception as e:
+        if "moved or deleted" in str(e).lower():
+            print(f"✅ Đã gửi email gộp cho PO {', '.join(po_numbers)} (Outlook đã di chuyển email)")
+        else:
+            print(f"❌ Lỗi gửi email gộp cho PO {', '.join(po_numbers)}: {e}")
+            return False
     return True
 
-def main_send_all(output_base_dir):
+def send_emails_batched(df_pending, output_base_dir, max_attachment_mb=EMAIL_MAX_ATTACHMENT_MB):
+    """
+    Send pending requests as one email per supplier address set and entity.
+
+    Each group lists its POs in the body and carries every PO's PDF and
+    template copy; groups whose attachments exceed ``max_attachment_mb`` are
+    split over several emails. Returns the rows (as dicts) of the POs that
+    were included in a sent email.
+    """
+    outlook = win32com.client.Dispatch("Outlook.Application")
+    max_bytes = max_attachment_mb * 1024 * 1024
+    sent_rows = []
+    for to_emails, buyer, rows in group_by_supplier(df_pending):
+        items = []
+        for _, po_row in rows.iterrows():
+            attachments, template_file = get_attachments(po_row["PO Number"], po_row["Currency"], output_base_dir)
+            if template_file is None:
+                print(f"❌ Không thể đính kèm file template cho PO {po_row['PO Number']}, PO này sẽ không được gửi.")
+                _cleanup_temp_attachments(attachments)
+                continue
+            items.append((po_row, attachments))
+
+        for chunk in split_by_attachment_size(items, max_bytes):
+            if send_batch_email_outlook(to_emails, buyer, chunk, outlook=outlook):
+                sent_rows.extend(po_row.to_dict() for po_row, _ in chunk)
+            for _, attachments in chunk:
+                _cleanup_temp_attachments(attachments)
+    return sent_rows
+
+def main_send_all(output_base_dir, batch=False):
     df = load_log(output_base_dir)
     if df is None:
         return
@@ -133,13 +290,21 @@ def main_send_all(output_base_dir):
         print("✅ Không có PO nào cần gửi email.")
         return
 
-    for idx, row in df_filtered.iterrows():
-        success = send_email_outlook(row, output_base_dir)
-        if success:
-            df.loc[(df["PO Number"] == row["PO Number"]), "Email Request Info"] = "Yes"
+    sent_rows = []
+    if batch:
+        sent_rows = send_emails_batched(df_filtered, output_base_dir)
+        sent_pos = [row["PO Number"] for row in sent_rows]
+        df.loc[df["PO Number"].isin(sent_pos), "Email Request Info"] = "Yes"
+    else:
+        for idx, row in df_filtered.iterrows():
+            success = send_email_outlook(row, output_base_dir)
+            if success:
+                df.loc[(df["PO Number"] == row["PO Number"]), "Email Request Info"] = "Yes"
+                sent_rows.append(row.to_dict())
 
     log_file = Path(output_base_dir) / "log" / "po_log.csv"
     df.to_csv(log_file, index=False, encoding="utf-8", quoting=1)
+    record_emails_sent(output_base_dir, sent_rows)
     print("📤 Đã cập nhật cột 'Email Request Info' trong log.")
 
 if __name__ == "__main__":
@@ -0,0 +1,398 @@
+"""Partitioned, typed columnar archive of old PO log rows.
+
+``po_log.csv`` used to grow forever and every reader parsed all of it as
+strings. Rows received more than ``ARCHIVE_AFTER_DAYS`` ago that need no more
+work (not a ``Need_CDs == "Yes"`` PO still waiting for its request email) are
+moved by ``merge_thread_logs`` into a Parquet dataset::
+
+    <output>/archive/po_log/month=YYYY-MM/entity=<short name>/part-*.parquet
+
+Columns are typed (``Max Unit Price`` float, ``ReceivedTime`` timestamp) and
+zstd-compressed, and ``query_archive`` reads only the requested columns with
+the filters pushed down to partitions and row groups. ``po_log.csv`` keeps the
+hot working set only.
+
+A PO that is re-scanned after its row was archived is written to the log
+again; the archive keeps older versions and queries return the latest one
+(the hot log wins over the archive).
+
+``archive/po_log_index.csv`` maps each archived PO number to the Parquet files
+holding it, so ``lookup_archived`` (called on every merge) opens only those
+files instead of scanning the archive. It is rebuilt from the archive when
+missing (``python po_archive.py --output <output> --reindex``).
+
+pyarrow is optional: without it nothing is archived and the log keeps growing
+as before.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import shutil
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+from config import ARCHIVE_AFTER_DAYS
+from summary_stats import entity_of
+
+STRING_COLUMNS = [
+    "PO Number", "Buyer", "Seller", "VAT", "Currency", "UOM", "Need_CDs",
+    "Supplier/Vendor email", "End-User Email", "Email Request Info",
+]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+INDEX_COLUMNS = ["PO Number", "File"]
+
+
+def archive_available() -> bool:
+    return pa is not None
+
+
+def archive_dir(output_base_dir) -> Path:
+    return Path(output_base_dir) / "archive" / "po_log"
+
+
+def index_path(output_base_dir) -> Path:
+    return Path(output_base_dir) / "archive" / "po_log_index.csv"
+
+
+def _schema():
+    return pa.schema(
+        [(name, pa.string()) for name in STRING_COLUMNS[:6]]
+        + [("Max Unit Price", pa.float64())]
+        + [(name, pa.string()) for name in STRING_COLUMNS[6:]]
+        + [("ReceivedTime", pa.timestamp("s")), ("Archived At", pa.timestamp("s"))]
+    )
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([("month", pa.string()), ("entity", pa.string())]), flavor="hive")
+
+
+def _dataset_schema():
+    return _schema().append(pa.field("month", pa.string())).append(pa.field("entity", pa.string()))
+
+
+def to_typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert log rows (all strings) to the archive column types."""
+    typed = pd.DataFrame(index=df.index)
+    for name in STRING_COLUMNS:
+        values = df[name] if name in df.columns else pd.Series(None, index=df.index, dtype=object)
+        typed[name] = values.astype(object).where(values.notna(), None)
+    typed["Max Unit Price"] = pd.to_numeric(df.get("Max Unit Price"), errors="coerce").astype("float64")
+    typed["ReceivedTime"] = pd.to_datetime(df.get("ReceivedTime"), format=TIME_FORMAT, errors="coerce")
+    return typed
+
+
+def to_log_frame(typed: pd.DataFrame) -> pd.DataFrame:
+    """Convert archived rows back to the string form of ``po_log.csv``."""
+    df = typed.copy()
+    if "ReceivedTime" in df.columns:
+        df["ReceivedTime"] = df["ReceivedTime"].dt.strftime(TIME_FORMAT)
+    if "Max Unit Price" in df.columns:
+        df["Max Unit Price"] = df["Max Unit Price"].map(lambda v: "" if pd.isna(v) else repr(float(v)))
+    return df.drop(columns=["Archived At", "month", "entity"], errors="ignore")
+
+
+def split_hot_cold(df: pd.DataFrame, older_than_days: int = ARCHIVE_AFTER_DAYS):
+    """
+    Split log rows into ``(hot, cold)``.
+
+    Cold rows were received more than ``older_than_days`` days ago and have no
+    pending request email. Rows without a readable ``ReceivedTime`` stay hot.
+    """
+    received = pd.to_datetime(df["ReceivedTime"], format=TIME_FORMAT, errors="coerce")
+    email_sent = df["Email Request Info"] if "Email Request Info" in df.columns else pd.Series("", index=df.index)
+    pending = (df["Need_CDs"] == "Yes") & (email_sent != "Yes")
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    cold = (received < cutoff) & ~pending
+    return df[~cold], df[cold]
+
+
+def _append_index(output_base_dir, rows: list[tuple[str, str]]) -> None:
+    if not rows:
+        return
+    path = index_path(output_base_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(rows, columns=INDEX_COLUMNS).to_csv(
+        path, mode="a", header=not path.exists(), index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC
+    )
+
+
+def archive_rows(output_base_dir, df_cold: pd.DataFrame) -> int:
+    """
+    Append log rows to the archive; returns the number of rows written.
+
+    The batch is written to a new, empty staging folder (pyarrow refuses to
+    write into existing data there) with a random file name, then each file
+    is moved into its partition. Batches archived in the same second or by
+    two processes therefore never overwrite each other, and readers never see
+    a partly written file. The PO index is appended last.
+    """
+    if df_cold.empty:
+        return 0
+    typed = to_typed_frame(df_cold)
+    now = datetime.now().replace(microsecond=0)
+    typed["Archived At"] = pd.Timestamp(now)
+    typed["month"] = typed["ReceivedTime"].dt.strftime("%Y-%m")
+    typed["entity"] = df_cold["Buyer"].map(entity_of)
+
+    table = pa.Table.from_pandas(typed, schema=_dataset_schema(), preserve_index=False)
+    root = archive_dir(output_base_dir)
+    staging = root.parent / ".staging" / uuid.uuid4().hex
+    try:
+        ds.write_dataset(
+            table,
+            staging,
+            format="parquet",
+            partitioning=_partitioning(),
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="error",
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+        index_rows = []
+        for staged in sorted(staging.rglob("*.parquet")):
+            relative = staged.relative_to(staging)
+            po_numbers = ds.dataset(staged, format="parquet").to_table(columns=["PO Number"]).column(0)
+            target = root / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.exists():
+                raise FileExistsError(f"Archive file already exists: {target}")
+            os.replace(staged, target)
+            index_rows += [(po, relative.as_posix()) for po in sorted(set(po_numbers.to_pylist()) - {None})]
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            staging.parent.rmdir()
+        except OSError:
+            pass
+    _append_index(output_base_dir, index_rows)
+    return len(typed)
+
+
+def move_cold_rows(output_base_dir, df: pd.DataFrame, older_than_days: int | None = ARCHIVE_AFTER_DAYS) -> pd.DataFrame:
+    """
+    Archive the cold rows of ``df`` and return the hot rows to keep in the log.
+
+    Returns ``df`` unchanged when archiving is disabled (``older_than_days``
+    falsy), pyarrow is not installed or nothing is old enough.
+    """
+    if not older_than_days or not archive_available() or df.empty:
+        return df
+    hot, cold = split_hot_cold(df, older_than_days)
+    if archive_rows(output_base_dir, cold):
+        print(f"🗄️ Đã chuyển {len(cold)} dòng cũ từ po_log sang archive")
+    return hot
+
+
+def archive_po_log(output_base_dir, older_than_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """Archive the cold rows of ``po_log.csv`` now; returns the rows moved."""
+    log_path = Path(output_base_dir) / "log" / "po_log.csv"
+    if not log_path.exists() or not archive_available():
+        return 0
+    df = pd.read_csv(log_path, dtype=str)
+    hot = move_cold_rows(output_base_dir, df, older_than_days)
+    if len(hot) != len(df):
+        hot.to_csv(log_path, index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
+    return len(df) - len(hot)
+
+
+def _dataset(output_base_dir, files: list[str] | None = None):
+    """The archive dataset, or only the given files (paths relative to the archive)."""
+    path = archive_dir(output_base_dir)
+    if not archive_available() or not path.exists():
+        return None
+    if files is None:
+        return ds.dataset(path, format="parquet", partitioning=_partitioning(), schema=_dataset_schema())
+    return ds.dataset(
+        [str(path / f) for f in files], format="parquet", partitioning=_partitioning(),
+        partition_base_dir=str(path), schema=_dataset_schema(),
+    )
+
+
+def rebuild_index(output_base_dir) -> int:
+    """Recreate ``po_log_index.csv`` from the archive files; returns its row count."""
+    dataset = _dataset(output_base_dir)
+    path = index_path(output_base_dir)
+    if dataset is None:
+        return 0
+    root = archive_dir(output_base_dir)
+    rows = []
+    for fragment in dataset.get_fragments():
+        relative = Path(fragment.path).relative_to(root).as_posix()
+        po_numbers = fragment.to_table(columns=["PO Number"]).column(0).to_pylist()
+        rows += [(po, relative) for po in sorted(set(po_numbers) - {None})]
+    tmp = path.with_suffix(".tmp")
+    pd.DataFrame(rows, columns=INDEX_COLUMNS).to_csv(tmp, index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def _load_index(output_base_dir) -> pd.DataFrame:
+    path = index_path(output_base_dir)
+    if not path.exists() and not rebuild_index(output_base_dir):
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    return pd.read_csv(path, dtype=str)
+
+
+def _latest(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the most recently archived version of each PO."""
+    return df.sort_values("Archived At", kind="stable").drop_duplicates(subset="PO Number", keep="last")
+
+
+def lookup_archived(output_base_dir, po_numbers) -> pd.DataFrame:
+    """
+    Latest archived rows of the given POs, in log (string) form.
+
+    Only the files listed for these POs in the PO index are read; POs that
+    were never archived cost one read of the index.
+    """
+    po_numbers = [str(po) for po in po_numbers]
+    if not archive_available() or not po_numbers or not archive_dir(output_base_dir).exists():
+        return pd.DataFrame()
+    index = _load_index(output_base_dir)
+    files = sorted(set(index.loc[index["PO Number"].isin(po_numbers), "File"]))
+    files = [f for f in files if (archive_dir(output_base_dir) / f).exists()]
+    if not files:
+        return pd.DataFrame()
+    table = _dataset(output_base_dir, files).to_table(filter=ds.field("PO Number").isin(po_numbers))
+    return to_log_frame(_latest(table.to_pandas()))
+
+
+def query_archive(
+    output_base_dir,
+    columns: list[str] | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    entity: str | None = None,
+    currency: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    need_cds: str | None = None,
+    include_hot: bool = False,
+) -> pd.DataFrame:
+    """
+    Query PO history from the archive with column pruning and pushed-down filters.
+
+    Parameters
+    ----------
+    columns : list[str], optional
+        Columns to return (all archive columns if None); only these and the
+        ones needed for de-duplication are read.
+    start, end : str, optional
+        Inclusive ``YYYY-MM-DD`` bounds on ``ReceivedTime``. Month partitions
+        outside the range are skipped.
+    entity : str, optional
+        Short entity name (partition), e.g. ``"TTI TOOLS"``.
+    currency, need_cds : str, optional
+        Exact ``Currency`` / ``Need_CDs`` value.
+    min_price, max_price : float, optional
+        Inclusive bounds on ``Max Unit Price``.
+    include_hot : bool
+        Also search the rows still in ``po_log.csv`` (they win over archived
+        versions of the same PO).
+
+    Returns
+    -------
+    pd.DataFrame
+        Typed rows, latest version per PO.
+
+    Example: all USD POs above 5000 last quarter
+    >>> query_archive(out, ["PO Number", "Seller", "Max Unit Price"], start="2026-07-01",
+    ...               end="2026-09-30", currency="USD", min_price=5000)
+    """
+    if not archive_available():
+        return pd.DataFrame(columns=columns or [])
+
+    conditions = []
+    if start:
+        conditions.append(ds.field("month") >= start[:7])
+        conditions.append(ds.field("ReceivedTime") >= pd.Timestamp(start).to_pydatetime())
+    if end:
+        conditions.append(ds.field("month") <= end[:7])
+        end_time = pd.Timestamp(end) + (pd.Timedelta(days=1) if len(end) <= 10 else pd.Timedelta(0))
+        conditions.append(ds.field("ReceivedTime") < end_time.to_pydatetime())
+    if entity:
+        conditions.append(ds.field("entity") == entity)
+    if currency:
+        conditions.append(ds.field("Currency") == currency)
+    if need_cds:
+        conditions.append(ds.field("Need_CDs") == need_cds)
+    if min_price is not None:
+        conditions.append(ds.field("Max Unit Price") >= float(min_price))
+    if max_price is not None:
+        conditions.append(ds.field("Max Unit Price") <= float(max_price))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    all_columns = _schema().names
+    wanted = columns or all_columns
+    read_columns = list(dict.fromkeys([*wanted, "PO Number", "Archived At"]))
+
+    frames = []
+    dataset = _dataset(output_base_dir)
+    if dataset is not None:
+        frames.append(dataset.to_table(columns=read_columns, filter=expression).to_pandas())
+    if include_hot:
+        log_path = Path(output_base_dir) / "log" / "po_log.csv"
+        if log_path.exists():
+            hot = to_typed_frame(pd.read_csv(log_path, dtype=str))
+            # Latest possible version, so hot rows win the de-duplication
+            hot["Archived At"] = pd.Timestamp.max.floor("s")
+            hot["month"] = hot["ReceivedTime"].dt.strftime("%Y-%m")
+            hot["entity"] = hot["Buyer"].map(entity_of)
+            table = pa.Table.from_pandas(hot, preserve_index=False)
+            frames.append(ds.dataset(table).to_table(columns=read_columns, filter=expression).to_pandas())
+    if not frames:
+        return pd.DataFrame(columns=wanted)
+
+    df = pd.concat([f for f in frames if not f.empty] or frames[:1], ignore_index=True)
+    return _latest(df)[wanted].reset_index(drop=True)
+
+
+__all__ = [
+    "archive_available",
+    "archive_dir",
+    "to_typed_frame",
+    "to_log_frame",
+    "split_hot_cold",
+    "archive_rows",
+    "move_cold_rows",
+    "archive_po_log",
+    "index_path",
+    "rebuild_index",
+    "lookup_archived",
+    "query_archive",
+]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Move old rows of po_log.csv to the Parquet archive")
+    parser.add_argument("--output", required=True, help="output folder (contains log/po_log.csv)")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive rows older than this")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the PO index of the archive")
+    args = parser.parse_args(argv)
+    if not archive_available():
+        print("❌ Cần cài pyarrow: pip install pyarrow")
+        return 1
+    if args.reindex:
+        print(f"🗂️ Indexed {rebuild_index(args.output)} PO/file pairs")
+        return 0
+    print(f"🗄️ Archived {archive_po_log(args.output, args.days)} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
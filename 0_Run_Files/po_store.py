@@ -0,0 +1,321 @@
+"""Content-addressed storage for the PDFs filed under ``PO_Filtered``.
+
+Revised POs and duplicate emails used to pile up near-identical copies in the
+``PO_Filtered/<buyer>`` folders. Each distinct PDF is now stored once in
+``<output>/po_store/objects`` under its SHA-256 hash, and the buyer folders
+contain hard links (or symlinks, or as a last resort copies) to those blobs
+with the same file names as before, so the folder view users browse does not
+change. Every PO revision is recorded in ``po_store/revisions.csv``.
+
+Because a visible file and its blob are the same file on disk, saving an edit
+to a PDF in a buyer folder would change the stored content of every folder
+that links it. Blobs are therefore made read-only; to annotate a PO, save a
+copy under another name.
+
+Buyer folders filed before the store existed are migrated with ``import``, and
+blobs whose visible files were all deleted are removed with ``prune``::
+
+    python po_store.py --output "<output>" import
+    python po_store.py --output "<output>" prune
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+import stat
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+REVISION_COLUMNS = ["PO Number", "Folder", "File", "SHA256", "Stored At"]
+
+# Blobs changed more recently than this are never pruned: another process may
+# be between storing the blob and linking it into a buyer folder
+PRUNE_MIN_AGE_SECONDS = 3600
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(blob: Path, link_path: Path) -> None:
+    """
+    Expose ``blob`` at ``link_path``: hard link, else symlink, else copy.
+
+    Raises ``FileExistsError`` if ``link_path`` exists; an existing file is
+    never written to, since it may be a hard link to another blob.
+    """
+    try:
+        os.link(blob, link_path)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        # Links not supported here or across devices
+        pass
+    try:
+        os.symlink(blob, link_path)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    with open(blob, "rb") as source, open(link_path, "xb") as target:
+        shutil.copyfileobj(source, target)
+    shutil.copystat(blob, link_path)
+
+
+def _make_read_only(path: Path) -> None:
+    os.chmod(path, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+
+
+def _unlink(path: Path) -> None:
+    """Remove ``path``, clearing the read-only flag Windows refuses to delete."""
+    try:
+        path.unlink(missing_ok=True)
+    except PermissionError:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        path.unlink(missing_ok=True)
+
+
+def _link_new(blob: Path, link_path: Path) -> Path:
+    """
+    Link ``blob`` at ``link_path`` or, if that name is taken, at the first free
+    ``<stem>_<timestamp>[_<n>]`` name; returns the path used.
+    """
+    try:
+        _link(blob, link_path)
+        return link_path
+    except FileExistsError:
+        pass
+    stamped = f"{link_path.stem}_{datetime.now():%Y%m%d%H%M%S}"
+    count = 0
+    while True:
+        candidate = link_path.with_name(f"{stamped}_{count}{link_path.suffix}" if count else f"{stamped}{link_path.suffix}")
+        try:
+            _link(blob, candidate)
+            return candidate
+        except FileExistsError:
+            count += 1
+
+
+def _same_file(a: Path, b: Path) -> bool:
+    try:
+        return os.path.samefile(a, b) or file_sha256(a) == file_sha256(b)
+    except OSError:
+        return False
+
+
+class PdfStore:
+    """Blob store plus revision index for one output folder."""
+
+    def __init__(self, output_base_dir):
+        output_base_dir = Path(output_base_dir)
+        self.root = output_base_dir / "po_store"
+        self.objects_dir = self.root / "objects"
+        self.index_path = self.root / "revisions.csv"
+        self.filtered_dir = output_base_dir / "PO_Filtered"
+        self._lock = threading.Lock()
+        self._revisions: list[dict] | None = None
+
+    def blob_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}.pdf"
+
+    def _load_revisions(self) -> list[dict]:
+        if self._revisions is None:
+            if self.index_path.exists():
+                with self.index_path.open(encoding="utf-8", newline="") as f:
+                    self._revisions = list(csv.DictReader(f))
+            else:
+                self._revisions = []
+        return self._revisions
+
+    def _append_revision(self, row: dict) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        is_new = not self.index_path.exists()
+        with self.index_path.open("a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REVISION_COLUMNS, quoting=csv.QUOTE_NONNUMERIC)
+            if is_new:
+                writer.writeheader()
+            writer.writerow(row)
+        self._load_revisions().append(row)
+
+    def _put_blob(self, src: Path) -> tuple[str, Path]:
+        """Store ``src`` under its hash (no-op if present); ``src`` is left in place."""
+        digest = file_sha256(src)
+        blob = self.blob_path(digest)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_suffix(".tmp")
+            tmp.unlink(missing_ok=True)
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copy2(src, tmp)
+            os.replace(tmp, blob)
+        return digest, blob
+
+    def add(self, src, folder_name: str, po_number: str) -> Path:
+        """
+        File ``src`` under ``PO_Filtered/<folder_name>`` and return the visible path.
+
+        The PDF is stored once by content. If the same content is already
+        filed in that folder no new entry is created; otherwise a link named
+        like the source file is added, with a timestamp suffix (and a counter
+        within the same second) when the name is taken by a different revision.
+        ``src`` is removed only after the link exists; the blob is then made
+        read-only.
+        """
+        src = Path(src)
+        with self._lock:
+            digest, blob = self._put_blob(src)
+            dest_dir = self.filtered_dir / folder_name
+
+            # Same content already visible in this folder (duplicate email)
+            for row in self._load_revisions():
+                if row["SHA256"] == digest and row["Folder"] == folder_name:
+                    existing = dest_dir / row["File"]
+                    if existing.exists():
+                        _unlink(src)
+                        _make_read_only(blob)
+                        return existing
+
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            link_path = dest_dir / src.name
+            if link_path.exists() and _same_file(link_path, blob):
+                _unlink(src)
+                _make_read_only(blob)
+                self._append_revision(self._revision_row(po_number, folder_name, link_path.name, digest))
+                return link_path
+            link_path = _link_new(blob, link_path)
+            self._append_revision(self._revision_row(po_number, folder_name, link_path.name, digest))
+            # src may be a hard link to the new blob, so seal the blob only once it is gone
+            _unlink(src)
+            _make_read_only(blob)
+            return link_path
+
+    @staticmethod
+    def _revision_row(po_number: str, folder_name: str, file_name: str, digest: str) -> dict:
+        return {
+            "PO Number": po_number,
+            "Folder": folder_name,
+            "File": file_name,
+            "SHA256": digest,
+            "Stored At": f"{datetime.now():%Y-%m-%d %H:%M:%S}",
+        }
+
+    def history(self, po_number: str) -> list[dict]:
+        """All stored revisions of a PO, oldest first."""
+        with self._lock:
+            return [row for row in self._load_revisions() if row["PO Number"] == str(po_number)]
+
+    def import_existing(self) -> int:
+        """
+        Move PDFs already in the buyer folders into the store (one-time migration).
+
+        Each regular file is replaced by a link to its blob, so identical
+        copies end up sharing one blob. Returns the number of files converted.
+        """
+        converted = 0
+        if not self.filtered_dir.exists():
+            return converted
+        with self._lock:
+            known = {(row["Folder"], row["File"]) for row in self._load_revisions()}
+            for path in sorted(self.filtered_dir.glob("*/*.pdf")):
+                if path.is_symlink() or (path.parent.name, path.name) in known:
+                    continue
+                digest, blob = self._put_blob(path)
+                if not os.path.samefile(path, blob):
+                    tmp = path.with_suffix(".pdf.tmp")
+                    # A leftover tmp may be a link to another blob: remove it, never write to it
+                    tmp.unlink(missing_ok=True)
+                    _link(blob, tmp)
+                    os.replace(tmp, path)
+                _make_read_only(blob)
+                self._append_revision(self._revision_row("", path.parent.name, path.name, digest))
+                converted += 1
+        return converted
+
+    def prune(self, min_age_seconds: float = PRUNE_MIN_AGE_SECONDS) -> tuple[int, int]:
+        """
+        Delete blobs that no buyer folder refers to any more.
+
+        A blob is unreferenced when its hard-link count is 1 (only the store
+        holds it), no symlink under ``PO_Filtered`` points to it and no
+        revision's visible file with the same hash still exists (the copy
+        fallback). The revision history is kept. Returns ``(blobs removed,
+        bytes freed)``.
+        """
+        removed = freed = 0
+        if not self.objects_dir.exists():
+            return removed, freed
+        with self._lock:
+            symlinked = set()
+            if self.filtered_dir.exists():
+                for path in self.filtered_dir.glob("*/*.pdf"):
+                    if path.is_symlink():
+                        symlinked.add(os.path.realpath(path))
+            copied = {
+                row["SHA256"] for row in self._load_revisions()
+                if (self.filtered_dir / row["Folder"] / row["File"]).exists()
+            }
+            now = time.time()
+            for blob in sorted(self.objects_dir.glob("*/*.pdf")):
+                try:
+                    stat = blob.stat()
+                except OSError:
+                    continue
+                if stat.st_nlink > 1 or now - max(stat.st_mtime, stat.st_ctime) < min_age_seconds:
+                    continue
+                if os.path.realpath(blob) in symlinked or blob.stem in copied:
+                    continue
+                try:
+                    _unlink(blob)
+                except OSError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+            for shard in self.objects_dir.iterdir():
+                if shard.is_dir() and not any(shard.iterdir()):
+                    shard.rmdir()
+        return removed, freed
+
+
+__all__ = ["REVISION_COLUMNS", "PRUNE_MIN_AGE_SECONDS", "PdfStore", "file_sha256"]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the PDF store behind PO_Filtered")
+    parser.add_argument("--output", required=True, help="output folder (contains PO_Filtered and po_store)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import", help="move PDFs already in the buyer folders into the store")
+    prune_parser = commands.add_parser("prune", help="delete blobs no buyer folder refers to")
+    prune_parser.add_argument("--min-age", type=float, default=PRUNE_MIN_AGE_SECONDS,
+                              help="keep blobs changed less than this many seconds ago")
+    history_parser = commands.add_parser("history", help="list the stored revisions of a PO")
+    history_parser.add_argument("po_number")
+    args = parser.parse_args(argv)
+
+    store = PdfStore(args.output)
+    if args.command == "import":
+        print(f"📦 Đã chuyển {store.import_existing()} PDF vào po_store")
+    elif args.command == "prune":
+        removed, freed = store.prune(args.min_age)
+        print(f"🧹 Đã xóa {removed} blob không còn dùng ({freed / (1024 * 1024):.1f} MB)")
+    else:
+        for row in store.history(args.po_number):
+            print(f"{row['Stored At']}  {row['Folder']}/{row['File']}  {row['SHA256'][:12]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
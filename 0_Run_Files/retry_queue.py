@@ -0,0 +1,171 @@
+"""Quarantine folder and retry manifest for PDFs that failed processing.
+
+Previously a failure in ``process_po_pdfs`` only produced a free-text line in
+``log/error.txt`` and the source PDF was deleted together with ``temp/``, so
+recovering meant re-fetching and re-scanning the whole batch. Failed PDFs are
+now moved to ``<output>/quarantine`` and described in a structured manifest
+(``log/retry_manifest.csv``) so a retry run can reprocess only those files.
+"""
+from __future__ import annotations
+
+import csv
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+MANIFEST_COLUMNS = [
+    "pdf_path", "original_name", "stage", "error_type", "error", "attempts",
+    "last_attempt", "to_emails", "received_time", "subject",
+]
+
+_manifest_lock = threading.Lock()
+
+
+def quarantine_dir(output_base_dir) -> Path:
+    return Path(output_base_dir) / "quarantine"
+
+
+def manifest_path(output_base_dir) -> Path:
+    return Path(output_base_dir) / "log" / "retry_manifest.csv"
+
+
+def load_manifest(output_base_dir) -> dict[str, dict]:
+    """Return the manifest entries keyed by quarantined ``pdf_path``."""
+    path = manifest_path(output_base_dir)
+    if not path.exists():
+        return {}
+    df = pd.read_csv(path, dtype=str).fillna("")
+    return {row["pdf_path"]: row for row in df.to_dict("records")}
+
+
+def save_manifest(output_base_dir, entries: dict[str, dict]) -> None:
+    path = manifest_path(output_base_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df = pd.DataFrame(list(entries.values()), columns=MANIFEST_COLUMNS)
+    df.to_csv(path, index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC)
+
+
+def is_quarantined(pdf_path, output_base_dir) -> bool:
+    return Path(pdf_path).resolve().parent == quarantine_dir(output_base_dir).resolve()
+
+
+def next_retry_at(entry: dict, base_delay: float) -> float:
+    """Epoch time after which ``entry`` may be retried (exponential backoff)."""
+    attempts = max(int(entry.get("attempts") or 1), 1)
+    last = datetime.strptime(entry["last_attempt"], "%Y-%m-%d %H:%M:%S").timestamp()
+    return last + base_delay * 2 ** (attempts - 1)
+
+
+def quarantine_failures(output_base_dir, failures: list[dict]) -> None:
+    """
+    Move failed PDFs into the quarantine folder and record them in the manifest.
+
+    Parameters
+    ----------
+    output_base_dir : Path
+        The base directory where ``log`` and ``quarantine`` folders reside.
+    failures : list[dict]
+        One dict per failed PDF with keys ``pdf_path``, ``stage`` (e.g.
+        ``"open"``, ``"scan"``, ``"rename"``), ``error`` (the exception) and
+        the email metadata (``to_emails``, ``received_time``, ``subject``).
+        An explicit ``error_type`` is used when ``error`` is only a message
+        (failures reported by worker nodes, see ``work_queue``).
+        A PDF that is already quarantined has its attempt count increased.
+    """
+    if not failures:
+        return
+    q_dir = quarantine_dir(output_base_dir)
+    q_dir.mkdir(parents=True, exist_ok=True)
+    now = f"{datetime.now():%Y-%m-%d %H:%M:%S}"
+
+    with _manifest_lock:
+        entries = load_manifest(output_base_dir)
+        for failure in failures:
+            src = Path(failure["pdf_path"])
+            if not src.exists():
+                continue
+            if is_quarantined(src, output_base_dir):
+                dest = src
+                previous = entries.get(str(dest), {})
+                attempts = int(previous.get("attempts") or 0) + 1
+                original_name = previous.get("original_name") or src.name
+            else:
+                dest = q_dir / src.name
+                count = 1
+                while dest.exists():
+                    dest = q_dir / f"{src.stem}_{count}{src.suffix}"
+                    count += 1
+                try:
+                    shutil.move(str(src), str(dest))
+                except Exception as e:
+                    print(f"⚠️ Không thể chuyển file vào quarantine: {src} - {e}")
+                    continue
+                attempts = 1
+                original_name = src.name
+
+            error = failure.get("error")
+            entries[str(dest)] = {
+                "pdf_path": str(dest),
+                "original_name": original_name,
+                "stage": failure.get("stage", ""),
+                "error_type": failure.get("error_type") or (type(error).__name__ if error is not None else ""),
+                "error": str(error or "").replace("\n", " "),
+                "attempts": str(attempts),
+                "last_attempt": now,
+                "to_emails": failure.get("to_emails", "") or "",
+                "received_time": failure.get("received_time", "") or "",
+                "subject": failure.get("subject", "") or "",
+            }
+        save_manifest(output_base_dir, entries)
+
+
+def mark_recovered(output_base_dir, pdf_paths) -> None:
+    """Drop successfully reprocessed PDFs from the manifest and quarantine."""
+    pdf_paths = [str(p) for p in pdf_paths]
+    if not pdf_paths:
+        return
+    with _manifest_lock:
+        entries = load_manifest(output_base_dir)
+        for path in pdf_paths:
+            entries.pop(path, None)
+            Path(path).unlink(missing_ok=True)
+        save_manifest(output_base_dir, entries)
+
+
+def pending_entries(output_base_dir, max_attempts: int) -> list[dict]:
+    """Manifest entries that have not yet used up ``max_attempts``."""
+    return [
+        entry for entry in load_manifest(output_base_dir).values()
+        if int(entry.get("attempts") or 0) < max_attempts
+    ]
+
+
+def wait_for_due(entries: list[dict], base_delay: float) -> list[dict]:
+    """Sleep until at least one entry is due for retry and return the due ones."""
+    if not entries:
+        return []
+    next_times = [next_retry_at(entry, base_delay) for entry in entries]
+    delay = min(next_times) - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    now = time.time()
+    return [entry for entry, at in zip(entries, next_times) if at <= now]
+
+
+__all__ = [
+    "MANIFEST_COLUMNS",
+    "quarantine_dir",
+    "manifest_path",
+    "load_manifest",
+    "save_manifest",
+    "is_quarantined",
+    "next_retry_at",
+    "quarantine_failures",
+    "mark_recovered",
+    "pending_entries",
+    "wait_for_due",
+]
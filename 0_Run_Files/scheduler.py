@@ -0,0 +1,253 @@
+"""Cost-aware scheduling of PDF scans.
+
+``process_po_pdfs`` used to submit PDFs in email order to a pool of a fixed
+``MAX_WORKERS`` threads, so a large PO submitted last decided the batch time.
+This module estimates each document's cost up front (page count read from the
+PDF page tree, falling back to file size), orders the batch largest-first
+(LPT) and sizes the pool from the CPU count and the available memory. The
+pool is a process pool (see ``m02_pdf_scan.get_scan_pool``): pdfminer parsing
+holds the GIL, so threads sized by core count would not add CPU parallelism.
+"""
+from __future__ import annotations
+
+import heapq
+import os
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from config import SCAN_SECONDS_PER_PAGE, WORKER_MEMORY_MB
+
+# Rough size of one page of an ERP PO export, used when the page count cannot
+# be read (e.g. page tree stored in a compressed object stream).
+AVG_BYTES_PER_PAGE = 60_000
+
+_PAGES_COUNT_RE = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b")
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)")
+_SUBSECTION_RE = re.compile(rb"\s*(\d+)\s+(\d+)\s*$")
+_ROOT_RE = re.compile(rb"/Root\s+(\d+)\s+\d+\s+R")
+_PREV_RE = re.compile(rb"/Prev\s+(\d+)")
+_PAGES_REF_RE = re.compile(rb"/Pages\s+(\d+)\s+\d+\s+R")
+_COUNT_RE = re.compile(rb"/Count\s+(\d+)")
+
+# Bytes read at the end of the file (startxref), per object and at most when
+# falling back to a plain scan of the page tree
+TAIL_BYTES = 4096
+OBJECT_WINDOW = 4096
+MAX_SCAN_BYTES = 2 * 1024 * 1024
+
+
+@dataclass
+class DocCost:
+    """Estimated cost of scanning one document, in pages."""
+
+    item: dict
+    size: int
+    pages: int | None
+    cost: float
+
+
+def _read_object(f, offset: int) -> bytes:
+    """Bytes of the indirect object starting at ``offset`` (up to ``endobj``)."""
+    f.seek(offset)
+    data = f.read(OBJECT_WINDOW)
+    end = data.find(b"endobj")
+    return data if end < 0 else data[:end]
+
+
+def _xref_sections(f, offset: int):
+    """
+    Parse one classic ``xref`` section without reading its entries.
+
+    Returns ``(subsections, trailer)`` where ``subsections`` lists
+    ``(first_object, count, file_position)``, or None for an xref stream.
+    """
+    f.seek(offset)
+    if f.readline().strip() != b"xref":
+        return None
+    subsections = []
+    while True:
+        position = f.tell()
+        line = f.readline()
+        match = _SUBSECTION_RE.match(line)
+        if not match:
+            f.seek(position)
+            break
+        first, count = int(match.group(1)), int(match.group(2))
+        subsections.append((first, count, f.tell()))
+        # Entries are exactly 20 bytes each, skip them
+        f.seek(f.tell() + 20 * count)
+    return subsections, f.read(OBJECT_WINDOW)
+
+
+def _page_count_from_xref(f, size: int) -> int | None:
+    """Follow startxref -> trailer /Root -> catalog /Pages -> /Count."""
+    f.seek(max(size - TAIL_BYTES, 0))
+    matches = _STARTXREF_RE.findall(f.read())
+    if not matches:
+        return None
+    # Newest section first; /Prev links to older sections (incremental updates)
+    sections = []
+    offset, root = int(matches[-1]), None
+    while offset is not None and len(sections) < 32:
+        parsed = _xref_sections(f, offset)
+        if parsed is None:
+            return None
+        subsections, trailer = parsed
+        sections.append(subsections)
+        if root is None:
+            match = _ROOT_RE.search(trailer)
+            root = int(match.group(1)) if match else None
+        prev = _PREV_RE.search(trailer)
+        offset = int(prev.group(1)) if prev else None
+    if root is None:
+        return None
+
+    def object_offset(number: int) -> int | None:
+        for subsections in sections:
+            for first, count, position in subsections:
+                if first <= number < first + count:
+                    f.seek(position + 20 * (number - first))
+                    entry = f.read(20).split()
+                    if len(entry) == 3 and entry[2] == b"n":
+                        return int(entry[0])
+                    return None
+        return None
+
+    root_offset = object_offset(root)
+    if root_offset is None:
+        return None
+    match = _PAGES_REF_RE.search(_read_object(f, root_offset))
+    pages_offset = object_offset(int(match.group(1))) if match else None
+    if pages_offset is None:
+        return None
+    match = _COUNT_RE.search(_read_object(f, pages_offset))
+    return int(match.group(1)) if match else None
+
+
+def estimate_page_count(pdf_path) -> int | None:
+    """
+    Read the page count from the PDF page tree without parsing the document.
+
+    The count is taken from the root ``/Pages`` node found through the
+    trailer and the cross-reference table, reading only the end of the file,
+    the xref section and two small objects. For cross-reference streams
+    (compressed xref) at most ``MAX_SCAN_BYTES`` from the start and end of the
+    file are scanned for ``/Type /Pages`` nodes instead; the root node holds
+    the largest ``/Count``. Returns ``None`` when no count is found.
+    """
+    try:
+        with open(pdf_path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            try:
+                count = _page_count_from_xref(f, size)
+            except (ValueError, IndexError):
+                count = None
+            if count is not None:
+                return count
+            half = MAX_SCAN_BYTES // 2
+            f.seek(0)
+            if size <= MAX_SCAN_BYTES:
+                data = f.read()
+            else:
+                data = f.read(half)
+                f.seek(size - half)
+                data += b"\n" + f.read(half)
+    except OSError:
+        return None
+    counts = [int(a or b) for a, b in _PAGES_COUNT_RE.findall(data)]
+    return max(counts) if counts else None
+
+
+def estimate_cost(item: dict) -> DocCost:
+    """Estimate the scan cost of one ``email_results`` entry."""
+    path = Path(item.get("pdf_path", ""))
+    try:
+        size = path.stat().st_size
+    except OSError:
+        size = 0
+    pages = estimate_page_count(path) if size else None
+    cost = float(pages) if pages else max(size / AVG_BYTES_PER_PAGE, 1.0)
+    return DocCost(item=item, size=size, pages=pages, cost=cost)
+
+
+def available_memory_bytes() -> int | None:
+    """Physical memory currently available, or ``None`` if unknown."""
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return int(status.ullAvailPhys)
+        return None
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def choose_pool_size(n_tasks: int, max_workers: int | None = None) -> int:
+    """
+    Size the worker pool from CPU count and available memory.
+
+    Each worker is assumed to need ``WORKER_MEMORY_MB`` while parsing a PDF.
+    ``max_workers`` (``Settings.MAX_WORKERS``) is an optional upper bound.
+    """
+    size = os.cpu_count() or 1
+    memory = available_memory_bytes()
+    if memory is not None:
+        size = min(size, max(memory // (WORKER_MEMORY_MB * 1024 * 1024), 1))
+    if max_workers:
+        size = min(size, max_workers)
+    return max(1, min(size, n_tasks or 1))
+
+
+def predict_makespan(costs: list[float], workers: int) -> float:
+    """Predicted batch time (seconds) when ``costs`` are dispatched in order."""
+    loads = [0.0] * max(workers, 1)
+    for cost in costs:
+        # Each task goes to the worker that becomes free first
+        heapq.heapreplace(loads, loads[0] + cost * SCAN_SECONDS_PER_PAGE)
+    return max(loads) if costs else 0.0
+
+
+def plan_batch(email_results: list[dict], max_workers: int | None = None):
+    """
+    Order a scan batch largest-first and choose the pool size.
+
+    Returns
+    -------
+    tuple[list[dict], int, float]
+        The ``email_results`` entries in LPT order, the pool size and the
+        predicted makespan in seconds.
+    """
+    doc_costs = sorted((estimate_cost(item) for item in email_results), key=lambda d: d.cost, reverse=True)
+    workers = choose_pool_size(len(doc_costs), max_workers)
+    predicted = predict_makespan([d.cost for d in doc_costs], workers)
+    return [d.item for d in doc_costs], workers, predicted
+
+
+__all__ = [
+    "DocCost",
+    "estimate_page_count",
+    "estimate_cost",
+    "available_memory_bytes",
+    "choose_pool_size",
+    "predict_makespan",
+    "plan_batch",
+]
@@ -0,0 +1,334 @@
+"""Materialized per-entity, per-day counters of the PO log.
+
+The GUI summary and entity filter used to re-read the whole ``po_log.csv`` and
+loop over it row by row after every run. ``SummaryCounters`` keeps small
+aggregates (one row per day and entity) in ``log/summary_counts.csv`` that are
+updated incrementally whenever rows are merged into the log or request emails
+are sent. Totals per entity are held in memory so the summary panel reads them
+in constant time, and historical reports query the counters instead of the log.
+
+Several processes may update the same counters (the GUI, a ``work_queue.py
+merge`` coordinator, ``main_send_all`` from the command line). Every update
+takes a lock file, re-reads ``summary_counts.csv`` if another process changed
+it, applies the change and writes the file back; reads re-load the file when
+its modification stamp changed.
+"""
+from __future__ import annotations
+
+import csv
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from config import ENTITY_SHORT_NAMES
+
+COUNTER_FIELDS = [
+    "Total", "Need_CDs_Yes", "Need_CDs_No", "Need_CDs_Revised",
+    "Emails_Sent", "Emails_Pending",
+]
+COLUMNS = ["Date", "Entity", *COUNTER_FIELDS]
+
+_NEED_CDS_FIELDS = {"Yes": "Need_CDs_Yes", "No": "Need_CDs_No", "Revised": "Need_CDs_Revised"}
+
+# The lock holder touches the lock file every LOCK_STALE_SECONDS / 3; a lock
+# not touched for LOCK_STALE_SECONDS is left over from a crashed process
+LOCK_STALE_SECONDS = 30.0
+
+_instances: dict[Path, "SummaryCounters"] = {}
+_instances_lock = threading.Lock()
+
+
+def entity_of(buyer) -> str:
+    """Short entity name used in the GUI for a ``Buyer`` value of the log."""
+    buyer = buyer.strip() if isinstance(buyer, str) else ""
+    return ENTITY_SHORT_NAMES.get(buyer, buyer if buyer else "Unknown")
+
+
+def _day_of(received_time) -> str:
+    if isinstance(received_time, str) and len(received_time) >= 10:
+        return received_time[:10]
+    return "Unknown"
+
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process with this PID is running on this machine."""
+    if sys.platform == "win32":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: exists, other user
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _lock_is_stale(lock_path: Path) -> bool:
+    """
+    A lock is stale when its owner (``<pid> <host>`` in the file) has exited
+    on this machine, or when it was not touched for ``LOCK_STALE_SECONDS``
+    (the owner is on another machine of a shared output folder and died).
+    """
+    try:
+        owner = lock_path.read_text(encoding="utf-8").split()
+        age = time.time() - lock_path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    if len(owner) == 2 and owner[1] == socket.gethostname() and owner[0].isdigit():
+        return not _pid_alive(int(owner[0]))
+    return age > LOCK_STALE_SECONDS
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """
+    Cross-process lock: exclusive creation of ``<path>.lock``.
+
+    The file holds the owner's PID and host name, and a background thread
+    touches it while the lock is held, so a long ``rebuild`` is never taken
+    for a crashed process.
+    """
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _lock_is_stale(lock_path):
+                lock_path.unlink(missing_ok=True)
+                continue
+            time.sleep(0.05)
+            continue
+        try:
+            os.write(fd, f"{os.getpid()} {socket.gethostname()}".encode("utf-8"))
+        finally:
+            os.close(fd)
+        break
+
+    held = threading.Event()
+
+    def heartbeat():
+        while not held.wait(LOCK_STALE_SECONDS / 3):
+            try:
+                os.utime(lock_path)
+            except OSError:
+                pass
+
+    keeper = threading.Thread(target=heartbeat, daemon=True)
+    keeper.start()
+    try:
+        yield
+    finally:
+        held.set()
+        keeper.join()
+        lock_path.unlink(missing_ok=True)
+
+
+class SummaryCounters:
+    """Per-day, per-entity counters backed by ``log/summary_counts.csv``."""
+
+    def __init__(self, output_base_dir):
+        self.path = Path(output_base_dir) / "log" / "summary_counts.csv"
+        self.log_path = Path(output_base_dir) / "log" / "po_log.csv"
+        self._lock = threading.RLock()
+        self._counts: dict[tuple[str, str], dict[str, int]] = {}
+        self._totals: dict[str, dict[str, int]] = {}
+        self._stamp = None
+        if self.path.exists():
+            self._load()
+        elif self.log_path.exists():
+            # First run with counters: build them once from the existing log
+            self.rebuild()
+
+    def _file_stamp(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self) -> None:
+        self._counts.clear()
+        self._totals.clear()
+        stamp = self._file_stamp()
+        df = pd.read_csv(self.path, dtype=str).fillna("")
+        for row in df.to_dict("records"):
+            for field in COUNTER_FIELDS:
+                self._add(row["Date"], row["Entity"], field, int(row[field] or 0))
+        self._stamp = stamp
+
+    def _refresh(self) -> None:
+        """Re-load the counters if another process rewrote the file."""
+        stamp = self._file_stamp()
+        if stamp is not None and stamp != self._stamp:
+            self._load()
+
+    def _write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        rows = [
+            {"Date": day, "Entity": name, **values}
+            for (day, name), values in sorted(self._counts.items())
+            if any(values.values())
+        ]
+        # Write then rename, so other processes never read a partial file
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        pd.DataFrame(rows, columns=COLUMNS).to_csv(
+            tmp_path, index=False, encoding="utf-8", quoting=csv.QUOTE_NONNUMERIC
+        )
+        os.replace(tmp_path, self.path)
+        self._stamp = self._file_stamp()
+
+    @contextmanager
+    def _updating(self):
+        """Apply an update on top of the latest file contents and persist it."""
+        with self._lock, _file_lock(self.path):
+            self._refresh()
+            yield
+            self._write()
+
+    def _add(self, day: str, entity: str, field: str, delta: int) -> None:
+        bucket = self._counts.setdefault((day, entity), dict.fromkeys(COUNTER_FIELDS, 0))
+        bucket[field] += delta
+        totals = self._totals.setdefault(entity, dict.fromkeys(COUNTER_FIELDS, 0))
+        totals[field] += delta
+
+    def _apply_row(self, row: dict, sign: int) -> None:
+        day = _day_of(row.get("ReceivedTime"))
+        entity = entity_of(row.get("Buyer"))
+        need_cds = row.get("Need_CDs")
+        self._add(day, entity, "Total", sign)
+        if need_cds in _NEED_CDS_FIELDS:
+            self._add(day, entity, _NEED_CDS_FIELDS[need_cds], sign)
+        if need_cds == "Yes":
+            sent = row.get("Email Request Info") == "Yes"
+            self._add(day, entity, "Emails_Sent" if sent else "Emails_Pending", sign)
+
+    def record_rows(self, new_rows: list[dict], replaced_rows: list[dict] | tuple = ()) -> None:
+        """Count log rows that were written and remove the rows they replaced."""
+        with self._updating():
+            for row in replaced_rows:
+                self._apply_row(row, -1)
+            for row in new_rows:
+                self._apply_row(row, +1)
+
+    def record_emails_sent(self, rows: list[dict]) -> None:
+        """Move successfully emailed ``Need_CDs == "Yes"`` rows from pending to sent."""
+        with self._updating():
+            for row in rows:
+                day = _day_of(row.get("ReceivedTime"))
+                entity = entity_of(row.get("Buyer"))
+                self._add(day, entity, "Emails_Pending", -1)
+                self._add(day, entity, "Emails_Sent", +1)
+
+    def rebuild(self) -> None:
+        """Recompute all counters from ``po_log.csv`` and the archived rows."""
+        from po_archive import query_archive, to_log_frame
+
+        with self._lock, _file_lock(self.path):
+            self._counts.clear()
+            self._totals.clear()
+            df = pd.read_csv(self.log_path, dtype=str) if self.log_path.exists() else pd.DataFrame()
+            for row in df.to_dict("records"):
+                self._apply_row(row, +1)
+            archived = query_archive(
+                self.log_path.parent.parent,
+                columns=["PO Number", "Buyer", "Need_CDs", "Email Request Info", "ReceivedTime"],
+            )
+            if not archived.empty:
+                if not df.empty:
+                    archived = archived[~archived["PO Number"].isin(df["PO Number"])]
+                for row in to_log_frame(archived).to_dict("records"):
+                    self._apply_row(row, +1)
+            self._write()
+
+    def totals(self, entity: str | None = None) -> dict:
+        """All-time counters for one entity, or ``{entity: counters}`` for all."""
+        with self._lock:
+            self._refresh()
+            if entity is not None:
+                return dict(self._totals.get(entity, dict.fromkeys(COUNTER_FIELDS, 0)))
+            return {name: dict(values) for name, values in self._totals.items()}
+
+    def pending_emails(self, entity: str | None = None) -> int:
+        """Number of POs still waiting for a request email (``"ALL"``/None = all)."""
+        with self._lock:
+            self._refresh()
+            if entity is None or entity.upper() == "ALL":
+                return sum(v["Emails_Pending"] for v in self._totals.values())
+            for name, values in self._totals.items():
+                if name.upper() == entity.upper():
+                    return values["Emails_Pending"]
+            return 0
+
+    def query(self, start: str | None = None, end: str | None = None,
+              entity: str | None = None, by: str = "month") -> pd.DataFrame:
+        """
+        Aggregate counters over a date range without touching the PO log.
+
+        Parameters
+        ----------
+        start, end : str, optional
+            Inclusive ``YYYY-MM-DD`` bounds on the received date.
+        entity : str, optional
+            Short entity name to restrict the report to.
+        by : {"day", "month", "year"}
+            Period used to group the counters.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per period and entity with the summed counters.
+        """
+        width = {"day": 10, "month": 7, "year": 4}[by]
+        with self._lock:
+            self._refresh()
+            rows = [
+                {"Date": day, "Entity": name, **values}
+                for (day, name), values in self._counts.items()
+                if (start is None or day >= start)
+                and (end is None or day <= end)
+                and (entity is None or name == entity)
+            ]
+        df = pd.DataFrame(rows, columns=COLUMNS)
+        df["Period"] = df["Date"].str[:width]
+        return df.groupby(["Period", "Entity"], as_index=False)[COUNTER_FIELDS].sum()
+
+    def save(self) -> None:
+        """
+        Write the counters to disk.
+
+        Updates are already persisted by ``record_rows`` and
+        ``record_emails_sent``; this only creates the file when it is missing
+        and never overwrites counts written by another process.
+        """
+        with self._updating():
+            pass
+
+
+def get_counters(output_base_dir) -> SummaryCounters:
+    """Return the shared ``SummaryCounters`` for an output folder."""
+    key = Path(output_base_dir).resolve()
+    with _instances_lock:
+        counters = _instances.get(key)
+        if counters is None:
+            counters = SummaryCounters(key)
+            _instances[key] = counters
+        return counters
+
+
+__all__ = ["COUNTER_FIELDS", "SummaryCounters", "entity_of", "get_counters"]
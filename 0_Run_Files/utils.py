@@ -6,8 +6,6 @@ central place simplifies maintenance and encourages reuse.
 """
 from __future__ import annotations
 
-import win32com.client  # type: ignore[import]
-
 def resolve_email(recipient, outlook) -> str | None:
     """Resolve an Outlook recipient to its SMTP address.
 
@@ -0,0 +1,503 @@
+"""Multi-node PDF scanning through a shared work-queue directory.
+
+``process_po_pdfs`` runs inside one process and writes ``log/thread_<ident>``
+files that assume one host. In distributed mode the fetched PDFs are put in a
+queue directory on a share that every node can reach::
+
+    <queue>/staging/<job>            job being written by ``enqueue_pdfs``
+    <queue>/pending/<job>~<attempt>  waiting for a worker
+    <queue>/leased/<job>~<attempt>@<node>@<expiry>
+    <queue>/done/<job>               scanned, holds the PDF and shard.json
+    <queue>/failed/<job>             lease expired QUEUE_MAX_ATTEMPTS times
+    <queue>/merged/<job>             already merged into the PO log
+
+Each job is a directory with the PDF and ``meta.json`` (email metadata).
+Every state change is a single ``os.rename`` of the job directory, so only one
+node can claim a job. The lease expiry (epoch seconds) is part of the name: a
+worker renews its leases by renaming them with a new expiry, and any node may
+move an expired lease back to ``pending`` (or to ``failed``). Node clocks must
+be roughly in sync.
+
+Workers copy the claimed PDFs to a local work directory, scan them with
+``scan_po_batch`` and write the result shard into the job directory before
+renaming it to ``done``. A worker that lost its lease cannot complete it.
+
+A single coordinator (``merge_done_jobs``) files the scanned PDFs, writes the
+rows to the PO log through ``merge_thread_logs`` and quarantines failures.
+Merging is idempotent: a job is moved to ``merged`` only after its rows are in
+a thread log, rows are de-duplicated by PO number, and a PDF that an
+interrupted merge already filed is not filed again.
+
+Usage (one local process per node, for testing)::
+
+    python work_queue.py local --queue Q --output OUT --pdfs DIR --nodes 4
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from config import QUEUE_BATCH_SIZE, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS
+
+STATES = ("staging", "pending", "leased", "done", "failed", "merged")
+
+_LEASE_RE = re.compile(r"(?P<job>[0-9a-f]+)~(?P<attempt>\d+)@(?P<node>[\w.-]+)@(?P<expiry>\d+)")
+_PENDING_RE = re.compile(r"(?P<job>[0-9a-f]+)~(?P<attempt>\d+)")
+
+
+def queue_dirs(queue_dir) -> dict[str, Path]:
+    """Create (if needed) and return the state folders of a queue."""
+    queue_dir = Path(queue_dir)
+    dirs = {state: queue_dir / state for state in STATES}
+    for path in dirs.values():
+        path.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+def default_node_id() -> str:
+    return re.sub(r"[^\w.-]", "_", f"{socket.gethostname()}-{os.getpid()}")
+
+
+def _pdf_of(job_dir: Path) -> Path | None:
+    return next(iter(sorted(job_dir.glob("*.pdf"))), None)
+
+
+def enqueue_pdfs(queue_dir, email_results: list[dict]) -> int:
+    """
+    Add fetched PDFs to the queue; returns the number of jobs created.
+
+    The PDF and its email metadata are written to ``staging`` first and the
+    finished job directory is renamed into ``pending``, so workers never see
+    a half-written job. Source PDFs are copied, not moved.
+    """
+    dirs = queue_dirs(queue_dir)
+    created = 0
+    for res in email_results:
+        src = Path(res.get("pdf_path", ""))
+        if not src.is_file():
+            continue
+        job_id = uuid.uuid4().hex
+        staging = dirs["staging"] / job_id
+        staging.mkdir()
+        shutil.copy2(src, staging / src.name)
+        meta = {
+            "file": src.name,
+            "to_emails": res.get("to_emails", ""),
+            "received_time": res.get("received_time", ""),
+            "subject": res.get("subject", ""),
+        }
+        (staging / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, default=str), encoding="utf-8")
+        os.rename(staging, dirs["pending"] / f"{job_id}~0")
+        created += 1
+    return created
+
+
+class Lease:
+    """A claimed job; renaming its directory renews or completes the lease."""
+
+    def __init__(self, queue_dir, path: Path, job_id: str, attempt: int, node_id: str):
+        self.dirs = queue_dirs(queue_dir)
+        self.path = path
+        self.job_id = job_id
+        self.attempt = attempt
+        self.node_id = node_id
+        self.lost = False
+        self._lock = threading.Lock()
+
+    def _lease_name(self, lease_seconds: float) -> str:
+        expiry = int(time.time() + lease_seconds)
+        return f"{self.job_id}~{self.attempt}@{self.node_id}@{expiry}"
+
+    def renew(self, lease_seconds: float) -> bool:
+        """Push the expiry forward; False once the lease has been taken away."""
+        with self._lock:
+            if self.lost:
+                return False
+            new_path = self.dirs["leased"] / self._lease_name(lease_seconds)
+            try:
+                os.rename(self.path, new_path)
+            except OSError:
+                self.lost = True
+                return False
+            self.path = new_path
+            return True
+
+    def copy_pdf(self, dest_dir: Path) -> tuple[Path | None, dict]:
+        """Copy the job's PDF to ``dest_dir``; returns the copy and the metadata."""
+        with self._lock:
+            meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+            src = self.path / meta["file"]
+            if not src.exists():
+                return None, meta
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            return Path(shutil.copy2(src, dest_dir / src.name)), meta
+
+    def complete(self, shard: dict) -> bool:
+        """Write the result shard and move the job to ``done``."""
+        with self._lock:
+            if self.lost:
+                return False
+            try:
+                (self.path / "shard.json").write_text(
+                    json.dumps(shard, ensure_ascii=False, default=str), encoding="utf-8"
+                )
+                os.rename(self.path, self.dirs["done"] / self.job_id)
+            except OSError:
+                self.lost = True
+                return False
+            return True
+
+
+def claim(queue_dir, node_id: str, limit: int = QUEUE_BATCH_SIZE,
+          lease_seconds: float = QUEUE_LEASE_SECONDS) -> list[Lease]:
+    """Lease up to ``limit`` pending jobs (oldest attempt count first)."""
+    dirs = queue_dirs(queue_dir)
+    leases: list[Lease] = []
+    candidates = []
+    for path in dirs["pending"].iterdir():
+        match = _PENDING_RE.fullmatch(path.name)
+        if match:
+            # Random order within an attempt count keeps nodes from racing for the same jobs
+            candidates.append((int(match["attempt"]), random.random(), path.name, match["job"]))
+    for attempt, _, name, job_id in sorted(candidates):
+        if len(leases) >= limit:
+            break
+        lease = Lease(queue_dir, dirs["pending"] / name, job_id, attempt, node_id)
+        target = dirs["leased"] / lease._lease_name(lease_seconds)
+        try:
+            os.rename(dirs["pending"] / name, target)
+        except OSError:
+            # Another node claimed it first
+            continue
+        lease.path = target
+        leases.append(lease)
+    return leases
+
+
+def reclaim_expired(queue_dir, max_attempts: int = QUEUE_MAX_ATTEMPTS, now: float | None = None) -> int:
+    """
+    Return expired leases to ``pending`` with the attempt count increased.
+
+    A job whose lease has expired ``max_attempts`` times (e.g. a PDF that
+    crashes the worker) is moved to ``failed`` instead. Returns the number of
+    leases reclaimed.
+    """
+    dirs = queue_dirs(queue_dir)
+    now = time.time() if now is None else now
+    reclaimed = 0
+    for path in dirs["leased"].iterdir():
+        match = _LEASE_RE.fullmatch(path.name)
+        if not match or int(match["expiry"]) >= now:
+            continue
+        attempt = int(match["attempt"]) + 1
+        if attempt >= max_attempts:
+            target = dirs["failed"] / match["job"]
+        else:
+            target = dirs["pending"] / f"{match['job']}~{attempt}"
+        try:
+            os.rename(path, target)
+        except OSError:
+            # Renewed or reclaimed by someone else in the meantime
+            continue
+        reclaimed += 1
+    return reclaimed
+
+
+class _LeaseKeeper(threading.Thread):
+    """Renews a batch of leases while it is being scanned."""
+
+    def __init__(self, leases: list[Lease], lease_seconds: float):
+        super().__init__(daemon=True)
+        self.leases = leases
+        self.lease_seconds = lease_seconds
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.lease_seconds / 3):
+            for lease in self.leases:
+                lease.renew(self.lease_seconds)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def process_leases(leases: list[Lease], work_dir, lease_seconds: float = QUEUE_LEASE_SECONDS) -> int:
+    """
+    Scan the PDFs of a batch of leases and complete them; returns jobs completed.
+
+    ``work_dir`` is local to the node: PDF copies, ``log/error.txt``,
+    ``log/scheduler.csv`` and the node's layout templates live there.
+    """
+    from m02_pdf_scan import scan_po_batch
+
+    work_dir = Path(work_dir)
+    keeper = _LeaseKeeper(leases, lease_seconds)
+    keeper.start()
+    try:
+        email_results = []
+        job_of: dict[Path, Lease] = {}
+        for lease in leases:
+            try:
+                local_pdf, meta = lease.copy_pdf(work_dir / "jobs" / lease.job_id)
+            except (OSError, ValueError):
+                continue
+            if local_pdf is None:
+                continue
+            job_of[local_pdf] = lease
+            email_results.append({**meta, "pdf_path": local_pdf})
+
+        scan = scan_po_batch(email_results, work_dir)
+    finally:
+        keeper.stop()
+
+    shards = {
+        lease.job_id: {"node": lease.node_id, "results": [], "failures": [], "rejected": [], "rejected_files": []}
+        for lease in leases
+    }
+    for item in scan["results"]:
+        lease = job_of[Path(item["pdf_path"])]
+        shards[lease.job_id]["results"].append({**item, "pdf_path": Path(item["pdf_path"]).name})
+    for failure in scan["failures"]:
+        lease = job_of[Path(failure["pdf_path"])]
+        error = failure.get("error")
+        shards[lease.job_id]["failures"].append({
+            **failure,
+            "pdf_path": Path(failure["pdf_path"]).name,
+            "error_type": type(error).__name__ if error is not None else "",
+            "error": str(error or ""),
+        })
+    for pdf_path, reason in scan["rejected_files"]:
+        lease = job_of[Path(pdf_path)]
+        shards[lease.job_id]["rejected"].append(reason)
+        shards[lease.job_id]["rejected_files"].append([Path(pdf_path).name, reason])
+
+    completed = 0
+    for lease in leases:
+        shard = {**shards[lease.job_id], "finished": f"{datetime.now():%Y-%m-%d %H:%M:%S}"}
+        if lease.complete(shard):
+            completed += 1
+        else:
+            print(f"⚠️ Lease của job {lease.job_id} đã hết hạn, bỏ kết quả")
+        shutil.rmtree(work_dir / "jobs" / lease.job_id, ignore_errors=True)
+    return completed
+
+
+def run_worker(queue_dir, work_dir=None, node_id: str | None = None, batch_size: int = QUEUE_BATCH_SIZE,
+               lease_seconds: float = QUEUE_LEASE_SECONDS, max_attempts: int = QUEUE_MAX_ATTEMPTS,
+               wait: bool = False, poll_seconds: float = 2.0) -> int:
+    """
+    Claim and scan jobs until the queue is empty (or forever with ``wait``).
+
+    Returns the number of jobs this node completed.
+    """
+    node_id = node_id or default_node_id()
+    work_dir = Path(work_dir) if work_dir else Path(tempfile.gettempdir()) / "po_scan_node"
+    completed = 0
+    while True:
+        reclaim_expired(queue_dir, max_attempts)
+        leases = claim(queue_dir, node_id, batch_size, lease_seconds)
+        if leases:
+            completed += process_leases(leases, work_dir, lease_seconds)
+            continue
+        # Nothing pending; leases held by other nodes may still expire
+        if not wait and not any(queue_dirs(queue_dir)["leased"].iterdir()):
+            break
+        time.sleep(poll_seconds)
+    print(f"✅ Node {node_id}: {completed} job")
+    return completed
+
+
+def merge_done_jobs(queue_dir, output_base_dir) -> dict:
+    """
+    Merge finished jobs into the PO log (run on one coordinator only).
+
+    PDFs that need CDs are filed under ``PO_Filtered``, non-PO PDFs are moved
+    to ``rejected/``, scan failures and jobs
+    in ``failed`` are quarantined for ``retry_failed_pdfs``, then every merged
+    job is moved to ``merged`` and the thread log is merged into ``po_log.csv``.
+
+    Returns
+    -------
+    dict
+        ``jobs`` merged, ``scanned``, ``failed`` and ``rejected``
+        (``{reason: count}``).
+    """
+    from m02_pdf_scan import file_scan_results, merge_thread_logs
+
+    dirs = queue_dirs(queue_dir)
+    output_base_dir = Path(output_base_dir)
+    scan = {"results": [], "failures": [], "rejected": {}, "rejected_files": [], "recovered": []}
+
+    done_jobs = sorted(p for p in dirs["done"].iterdir() if (p / "shard.json").exists())
+    for job_dir in done_jobs:
+        shard = json.loads((job_dir / "shard.json").read_text(encoding="utf-8"))
+        for item in shard["results"]:
+            item["pdf_path"] = job_dir / item["pdf_path"]
+            if not item["pdf_path"].exists():
+                # Filed by an earlier, interrupted merge
+                item["filtered_folder"] = None
+            scan["results"].append(item)
+        for failure in shard["failures"]:
+            failure["pdf_path"] = job_dir / failure["pdf_path"]
+            scan["failures"].append(failure)
+        for reason in shard["rejected"]:
+            scan["rejected"][reason] = scan["rejected"].get(reason, 0) + 1
+        for name, reason in shard.get("rejected_files", []):
+            scan["rejected_files"].append((job_dir / name, reason))
+
+    failed_jobs = sorted(dirs["failed"].iterdir())
+    for job_dir in failed_jobs:
+        pdf_path = _pdf_of(job_dir)
+        if pdf_path is None:
+            continue
+        try:
+            meta = json.loads((job_dir / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            meta = {}
+        scan["failures"].append({
+            "pdf_path": pdf_path,
+            "stage": "lease",
+            "error_type": "LeaseExpired",
+            "error": "worker did not finish the job before its lease expired",
+            "to_emails": meta.get("to_emails", ""),
+            "received_time": meta.get("received_time", ""),
+            "subject": meta.get("subject", ""),
+        })
+
+    jobs = done_jobs + failed_jobs
+    if not jobs:
+        return {"jobs": 0, "scanned": 0, "failed": 0, "rejected": {}}
+
+    file_scan_results(scan, output_base_dir)
+    for job_dir in jobs:
+        target = dirs["merged"] / job_dir.name
+        if target.exists():
+            shutil.rmtree(target)
+        os.rename(job_dir, target)
+        # Keep only meta.json and shard.json of merged jobs
+        for pdf_path in target.glob("*.pdf"):
+            pdf_path.unlink(missing_ok=True)
+    merge_thread_logs(output_base_dir)
+
+    if scan["rejected"]:
+        print(f"🚫 Bỏ qua {sum(scan['rejected'].values())} PDF không phải PO: {scan['rejected']}")
+    return {
+        "jobs": len(jobs),
+        "scanned": len(scan["results"]),
+        "failed": len(scan["failures"]),
+        "rejected": scan["rejected"],
+    }
+
+
+def queue_status(queue_dir) -> dict[str, int]:
+    """Number of jobs in each state."""
+    return {state: sum(1 for _ in path.iterdir()) for state, path in queue_dirs(queue_dir).items()}
+
+
+def _local_node(queue_dir: str, work_dir: str, node_id: str, batch_size: int, lease_seconds: float) -> int:
+    from m02_pdf_scan import shutdown_scan_pool
+
+    try:
+        return run_worker(queue_dir, work_dir, node_id, batch_size, lease_seconds)
+    finally:
+        shutdown_scan_pool()
+
+
+def run_local(queue_dir, output_base_dir, pdf_dir, nodes: int = 2, batch_size: int = QUEUE_BATCH_SIZE,
+              lease_seconds: float = QUEUE_LEASE_SECONDS) -> dict:
+    """Enqueue a folder of PDFs, scan it with ``nodes`` local processes and merge."""
+    pdfs = [{"pdf_path": p} for p in sorted(Path(pdf_dir).glob("*.pdf"))]
+    print(f"📥 Enqueue {enqueue_pdfs(queue_dir, pdfs)} PDF")
+    work_root = Path(tempfile.mkdtemp(prefix="po_scan_nodes_"))
+    args = [
+        (str(queue_dir), str(work_root / f"node{i}"), f"local{i}", batch_size, lease_seconds)
+        for i in range(nodes)
+    ]
+    started = time.perf_counter()
+    # Not multiprocessing.Pool: its daemonic workers cannot start the scan pool
+    with concurrent.futures.ProcessPoolExecutor(nodes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(_local_node, *zip(*args)))
+    print(f"⏱️ {nodes} node: {time.perf_counter() - started:.1f}s")
+    shutil.rmtree(work_root, ignore_errors=True)
+    return merge_done_jobs(queue_dir, output_base_dir)
+
+
+__all__ = [
+    "STATES",
+    "queue_dirs",
+    "enqueue_pdfs",
+    "Lease",
+    "claim",
+    "reclaim_expired",
+    "process_leases",
+    "run_worker",
+    "merge_done_jobs",
+    "queue_status",
+    "run_local",
+]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser("enqueue", help="add the PDFs of a folder to the queue")
+    p_enqueue.add_argument("--queue", required=True)
+    p_enqueue.add_argument("--pdfs", required=True)
+
+    p_worker = sub.add_parser("worker", help="run a worker node")
+    p_worker.add_argument("--queue", required=True)
+    p_worker.add_argument("--work-dir", default=None)
+    p_worker.add_argument("--node-id", default=None)
+    p_worker.add_argument("--batch-size", type=int, default=QUEUE_BATCH_SIZE)
+    p_worker.add_argument("--lease-seconds", type=float, default=QUEUE_LEASE_SECONDS)
+    p_worker.add_argument("--wait", action="store_true", help="keep polling when the queue is empty")
+
+    p_merge = sub.add_parser("merge", help="merge finished jobs into the PO log (coordinator)")
+    p_merge.add_argument("--queue", required=True)
+    p_merge.add_argument("--output", required=True)
+
+    p_status = sub.add_parser("status", help="number of jobs per state")
+    p_status.add_argument("--queue", required=True)
+
+    p_local = sub.add_parser("local", help="enqueue, scan with local processes and merge")
+    p_local.add_argument("--queue", required=True)
+    p_local.add_argument("--output", required=True)
+    p_local.add_argument("--pdfs", required=True)
+    p_local.add_argument("--nodes", type=int, default=2)
+    p_local.add_argument("--batch-size", type=int, default=QUEUE_BATCH_SIZE)
+    p_local.add_argument("--lease-seconds", type=float, default=QUEUE_LEASE_SECONDS)
+
+    args = parser.parse_args(argv)
+    if args.command == "enqueue":
+        pdfs = [{"pdf_path": p} for p in sorted(Path(args.pdfs).glob("*.pdf"))]
+        print(f"📥 Enqueue {enqueue_pdfs(args.queue, pdfs)} PDF")
+    elif args.command == "worker":
+        run_worker(args.queue, args.work_dir, args.node_id, args.batch_size, args.lease_seconds, wait=args.wait)
+    elif args.command == "merge":
+        print(f"📝 {merge_done_jobs(args.queue, args.output)}")
+    elif args.command == "status":
+        print(queue_status(args.queue))
+    elif args.command == "local":
+        print(f"📝 {run_local(args.queue, args.output, args.pdfs, args.nodes, args.batch_size, args.lease_seconds)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+